@@ -3,11 +3,19 @@
 KeePass module
 '''
 
-import os.path
+import os.path, socket
 
 from .kpdb import Database
 
-def get_entry(dbfilename, title, keyfilename=None, passphrase=None):
+def get_entry(dbfilename, title, keyfilename=None, passphrase=None, keycache=None,
+              use_agent=False):
+    '''Return the first entry with the given title in the file, or
+    None.  If use_agent is True and an agent of this user serves the
+    file (see keepass.agent) the entry is asked of it instead of
+    opening the file.  The agent then stands for the credentials,
+    which are not checked: proving them to it would take the key
+    transformation the agent is there to save.  Without an agent, or
+    if it refuses, the file is opened and the credentials checked.'''
 
     dbname = os.path.basename(dbfilename).split(".")[0]
     if keyfilename is None:
@@ -17,7 +25,19 @@ def get_entry(dbfilename, title, keyfilename=None, passphrase=None):
     filekey = infile.read().strip().decode('hex')
     infile.close()
 
-    db = Database(dbfilename, filekey=filekey, passphrase=passphrase)
+    if use_agent:
+        from . import agent
+        client = agent.connect(dbfilename)
+        if client is not None:
+            try:
+                return client.get(title)
+            except (agent.AgentError, socket.error):
+                pass            # fall back to opening the file
+            finally:
+                client.close()
+
+    db = Database(dbfilename, filekey=filekey, passphrase=passphrase,
+                  keycache=keycache, lazy=True)
     entry = db.get(title)
 
     return entry
@@ -0,0 +1,444 @@
+#!/usr/bin/env python
+'''
+An agent holding one unlocked database for other processes.
+
+Opening a file costs the key transformation and a full decrypt and
+parse.  The agent pays that once, keeps the Database with its
+indexes in memory and answers lookups over a Unix domain socket,
+which is how get_entry(..., use_agent=True) finds entries while an
+agent runs for the file.
+
+The socket lives in a directory only the user may enter, by default
+$XDG_RUNTIME_DIR (or the temporary directory) /keepass-agent-UID/,
+is named after the file, and is itself only accessible to the user.
+Both ends check that the other runs as the same user (SO_PEERCRED,
+so Linux only), and a client also checks the directory and socket
+before connecting, so that nobody else can pose as the agent.
+After idle_timeout seconds without a request the agent locks: it
+drops the database, removes its socket and returns.  It also locks
+when the file is changed or replaced, which it tells by comparing
+the inode, size and modification time of the file with those it
+had when opened on every request, rather than answer from a stale
+copy.
+
+The protocol is JSON Lines: each request is one JSON object on a
+line, answered by one JSON object on a line.  A request has an "op":
+
+ * ping - answer the "file" served
+ * get - answer the "entry" with the given "title", or the first of
+   those at the given "path", or null
+ * list - answer the "entries" without their passwords
+ * search - answer the "entries" matching "query", at most "limit"
+   of them, best first, with their "score", without passwords
+ * lock - lock at once
+
+A request may give the "key" digest of the transformed master key
+(see key_digest()), and is refused if it does not match the file's.
+The digest is of the stretched key so that a captured one costs a
+full key transformation per guessed passphrase.
+Answers have "ok" true, or false with an "error".  Entries are
+objects of their fields with times as "YYYY-MM-DD HH:MM:SS" and the
+attachment base64 encoded, see entry_record() and record_entry().
+
+Usage:
+
+    keepass-agent -p ask vault.kdb &
+    ...
+    client = agent.connect('vault.kdb')
+    if client: entry = client.get('My Email Account')
+'''
+
+import os, sys, stat, errno, time, struct, socket, threading, tempfile, hashlib, hmac, json
+from base64 import b64encode, b64decode
+from SocketServer import ThreadingMixIn, UnixStreamServer, StreamRequestHandler
+
+from infoblock import EntryInfo
+
+time_format = '%Y-%m-%d %H:%M:%S'
+
+def socket_dir():
+    'Return the directory holding the sockets of the agents of this user'
+    base = os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+    return os.path.join(base, 'keepass-agent-%d' % os.getuid())
+
+def socket_path(dbfilename):
+    'Return the path of the socket of the agent for the given file'
+    name = hashlib.sha1(os.path.abspath(dbfilename)).hexdigest()[:16]
+    return os.path.join(socket_dir(), name + '.sock')
+
+def private_dir(path):
+    '''Make the directory, accessible only to this user, unless it is
+    there.  Raise OSError if it is there but others may use it.'''
+    try:
+        os.mkdir(path, 0700)
+    except OSError, err:
+        if err.errno != errno.EEXIST: raise
+    check_private(path, stat.S_ISDIR)
+    return
+
+def check_private(path, is_type):
+    '''Raise OSError unless the path is of the type tested by is_type
+    (eg. stat.S_ISDIR), owned by this user and not accessible to
+    others.  Symbolic links are not followed.'''
+    info = os.lstat(path)
+    if not is_type(info.st_mode) or info.st_uid != os.getuid() or \
+            info.st_mode & 0077:
+        raise OSError, '%s is not private to this user' % path
+    return
+
+# getsockopt() option and struct ucred layout of Linux
+SO_PEERCRED = getattr(socket, 'SO_PEERCRED', 17)
+UCRED = struct.Struct('3i')
+
+def peer_uid(sock):
+    '''Return the user ID of the process at the other end of the Unix
+    socket.  Raise socket.error where that can not be told.'''
+    if not sys.platform.startswith('linux'):
+        raise socket.error, 'can not check the user of the agent on %s' % sys.platform
+    pid, uid, gid = UCRED.unpack(sock.getsockopt(socket.SOL_SOCKET, SO_PEERCRED, UCRED.size))
+    return uid
+
+def file_stamp(filename):
+    '''Return the (inode, size, modification time) of the file, or None
+    if it is gone'''
+    try:
+        info = os.stat(filename)
+    except OSError:
+        return None
+    return info.st_ino, info.st_size, info.st_mtime
+
+def key_digest(transformed_key):
+    '''Return the hex digest by which requests show their credentials,
+    given the transformed master key (see Database.transformed_key())'''
+    return hmac.new(transformed_key, 'keepass agent', hashlib.sha256).hexdigest()
+
+def utf8(value):
+    'Return JSON strings as the UTF-8 strings records hold'
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+def entry_record(entry, password=True):
+    'Return a mapping of the fields of the entry, fit for JSON'
+    ret = {}
+    for name, value in entry.asdict().iteritems():
+        if name == 'ignored' or value is None: continue
+        if name == 'password' and not password: continue
+        if name == 'binary_data':
+            value = b64encode(value)
+        elif hasattr(value, 'strftime'):
+            value = value.strftime(time_format)
+        ret[name] = value
+        continue
+    return ret
+
+def record_entry(record):
+    'Return a new EntryInfo from a mapping made by entry_record()'
+    from kpdb import import_value
+    coders = dict((name, coder) for name, coder, default
+                  in EntryInfo.format.itervalues() if name)
+    fields = {}
+    for name, value in record.iteritems():
+        if name not in coders: continue
+        if name == 'binary_data':
+            value = b64decode(value)
+        value = import_value(coders[name], value)
+        if value is not None:
+            fields[str(name)] = value
+        continue
+    return EntryInfo(**fields)
+
+class RequestHandler(StreamRequestHandler):
+    'Answer the JSON Lines requests of one connection'
+
+    def setup(self):
+        self.timeout = self.server.idle_timeout
+        StreamRequestHandler.setup(self)
+        return
+
+    def handle(self):
+        try:
+            if peer_uid(self.request) != os.getuid(): return
+        except socket.error:
+            return
+        while not self.server.locked:
+            try:
+                line = self.rfile.readline()
+            except socket.timeout:
+                break
+            if not line: break
+            try:
+                answer = self.server.answer(json.loads(line))
+            except Exception, err:
+                answer = dict(ok=False, error=str(err))
+            self.wfile.write(json.dumps(answer) + '\n')
+            self.wfile.flush()
+            if self.server.locked: break
+            continue
+        return
+
+    pass
+
+class Agent(ThreadingMixIn, UnixStreamServer):
+    '''
+    Serve lookups in the database on the socket at path, see module
+    documentation, until locked.  Each connection is served by its
+    own thread, one request at a time.
+    '''
+
+    daemon_threads = True
+    poll_interval = 0.5         # seconds between checks for being locked
+
+    def __init__(self, db, path=None, idle_timeout=900):
+        self.db = db
+        self.filename = os.path.abspath(db.filename)
+        self.stamp = file_stamp(self.filename)
+        self.path = path or socket_path(db.filename)
+        self.idle_timeout = idle_timeout
+        self.last_request = time.time()
+        self.locked = False
+        self.mutex = threading.Lock()
+        self.digest = key_digest(db.transformed_key())
+
+        # build the indexes up front so the first lookups are fast too
+        db.entry_index()
+        db.tree()
+        db.search_index()
+
+        directory = os.path.dirname(self.path)
+        private_dir(directory)
+        self._remove_stale()
+        umask = os.umask(0177)
+        try:
+            UnixStreamServer.__init__(self, self.path, RequestHandler)
+        finally:
+            os.umask(umask)
+        os.chmod(self.path, 0600)
+        return
+
+    def _remove_stale(self):
+        'Remove the socket left by an agent which is gone'
+        if not os.path.exists(self.path): return
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.path)
+        except socket.error:
+            os.remove(self.path)
+            return
+        finally:
+            probe.close()
+        raise OSError, 'an agent is already serving %s' % self.path
+
+    def idle(self):
+        'Return the seconds since the last request'
+        return time.time() - self.last_request
+
+    def serve(self):
+        'Answer requests until locked, by request or when idle'
+        try:
+            while not self.locked:
+                self.timeout = min(self.poll_interval,
+                                   max(0, self.idle_timeout - self.idle()))
+                self.handle_request()
+                continue
+        finally:
+            self.lock()
+            self.server_close()
+        return
+
+    def handle_timeout(self):
+        if self.idle() >= self.idle_timeout:
+            self.lock()
+        return
+
+    def lock(self):
+        '''Forget the database and remove the socket.  serve() returns
+        within poll_interval.'''
+        with self.mutex:
+            self._lock()
+        return
+
+    def _lock(self):
+        if self.locked: return
+        self.locked = True
+        self.db = None
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+        return
+
+    def answer(self, request):
+        'Return the answer to a request'
+        with self.mutex:
+            if self.locked:
+                return dict(ok=False, error='locked')
+            if file_stamp(self.filename) != self.stamp:
+                self._lock()
+                return dict(ok=False, error='file changed, locked')
+            self.last_request = time.time()
+            return self._answer(request)
+
+    def _answer(self, request):
+        key = request.get('key')
+        if key is not None and not hmac.compare_digest(str(key), self.digest):
+            return dict(ok=False, error='wrong key')
+
+        op = request.get('op')
+        db = self.db
+        if op == 'ping':
+            return dict(ok=True, file=db.filename)
+
+        if op == 'get':
+            if request.get('path'):
+                found = [rec for rec in db.resolve(utf8(request['path']))
+                         if isinstance(rec, EntryInfo)]
+                entry = found and found[0] or None
+            else:
+                entry = db.get(utf8(request.get('title')))
+            return dict(ok=True, entry=entry and entry_record(entry))
+
+        if op == 'list':
+            return dict(ok=True, entries=[entry_record(entry, password=False)
+                                          for entry in db.entries])
+
+        if op == 'search':
+            found = db.search_index().search(utf8(request.get('query', '')),
+                                             request.get('limit'))
+            entries = []
+            for score, entry in found:
+                record = entry_record(entry, password=False)
+                record['score'] = score
+                entries.append(record)
+                continue
+            return dict(ok=True, entries=entries)
+
+        if op == 'lock':
+            self._lock()
+            return dict(ok=True)
+
+        return dict(ok=False, error='unknown op "%s"' % op)
+
+    pass
+
+class AgentError(Exception):
+    'Raised when an agent refuses a request'
+    pass
+
+class Client(object):
+    '''
+    A connection to an agent.  Connecting raises socket.error if the
+    process at the other end is not of this user.  Requests raise
+    AgentError when refused and socket.error when the agent is gone.
+    '''
+
+    def __init__(self, path, key=None):
+        self.key = key
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.sock.connect(path)
+            if peer_uid(self.sock) != os.getuid():
+                raise socket.error, '%s is served by another user' % path
+        except:
+            self.sock.close()
+            raise
+        self.rfile = self.sock.makefile('rb')
+        return
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
+        return
+
+    def request(self, op, **args):
+        'Send a request and return its answer'
+        args['op'] = op
+        if self.key is not None:
+            args['key'] = self.key
+        self.sock.sendall(json.dumps(args) + '\n')
+        line = self.rfile.readline()
+        if not line:
+            raise socket.error, 'agent closed the connection'
+        answer = json.loads(line)
+        if not answer.get('ok'):
+            raise AgentError, answer.get('error')
+        return answer
+
+    def get(self, title=None, path=None):
+        'Return a new EntryInfo for the entry with the title, or at the path, or None'
+        record = self.request('get', title=title, path=path)['entry']
+        if record is None:
+            return None
+        return record_entry(record)
+
+    def list(self):
+        'Return the records of all entries, without passwords'
+        return self.request('list')['entries']
+
+    def search(self, query, limit=None):
+        'Return the records of the entries matching the query, best first'
+        return self.request('search', query=query, limit=limit)['entries']
+
+    def lock(self):
+        'Have the agent lock'
+        self.request('lock')
+        return
+
+    pass
+
+def connect(dbfilename, transformed_key=None, path=None):
+    '''Return a Client of the agent serving the given file, or None if
+    there is none or its directory, socket or process is not this
+    user's own.  If given, the transformed master key is checked by
+    the agent for every request.'''
+    path = path or socket_path(dbfilename)
+    key = transformed_key and key_digest(transformed_key)
+    try:
+        check_private(os.path.dirname(path), stat.S_ISDIR)
+        check_private(path, stat.S_ISSOCK)
+        return Client(path, key)
+    except (OSError, socket.error):
+        return None
+
+def main():
+    from optparse import OptionParser
+    from getpass import getpass
+    from kpdb import Database
+
+    parser = OptionParser('''%prog [options] <kdb file>
+
+    Open the file and serve lookups in it on a Unix domain socket,
+    whose path is printed, until idle for the timeout.''')
+    parser.add_option('-p', '--passphrase', type='string', default=None,
+                      help="Passphrase to open kdb with (Use 'ask' to be prompted)")
+    parser.add_option('-k', '--keyfile', type='string', default=None,
+                      help='Keyfile containing a key to open kdb with')
+    parser.add_option('-t', '--idle-timeout', type='float', default=900,
+                      help='Lock after this many seconds without a request, default: %default')
+    parser.add_option('-s', '--socket', type='string', default=None,
+                      help='Set the path of the socket, default: named after the file')
+    parser.add_option('-d', '--detach', action='store_true', default=False,
+                      help='Run in the background once the file is open')
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error('incorrect number of arguments')
+
+    if options.passphrase == 'ask' or not (options.passphrase or options.keyfile):
+        options.passphrase = getpass()
+    filekey = None
+    if options.keyfile:
+        infile = file(options.keyfile)
+        filekey = infile.read().strip().decode('hex')
+        infile.close()
+
+    db = Database(os.path.abspath(args[0]), filekey=filekey, passphrase=options.passphrase)
+    agent = Agent(db, options.socket, options.idle_timeout)
+    print agent.path
+    sys.stdout.flush()
+    if options.detach and os.fork():
+        os._exit(0)
+    agent.serve()
+    return
+
+if '__main__' == __name__:
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+'''
+Allocators for unique group IDs and entry UUIDs.
+
+An allocator draws random values in bulk from os.urandom and hands
+out those not already in use.  Values in use are those in the
+container given to the allocator (eg. a table of an index.Index,
+which stays current as records change) plus those it has handed out
+itself.
+'''
+
+import os, struct
+from binascii import b2a_hex
+
+class IdAllocator(object):
+    '''
+    Hand out unique 32 bit group IDs.  The values 0 and 0xFFFFFFFF
+    are reserved by the file format.
+    '''
+
+    size = 4
+    reserved = frozenset([0, 0xFFFFFFFF])
+
+    def __init__(self, used=None, taken=None):
+        if used is None:
+            used = set()
+        self.used = used
+        self.taken = set(taken or ())
+        return
+
+    def __contains__(self, value):
+        return value in self.reserved or value in self.used or value in self.taken
+
+    def draw(self, count):
+        'Return a list of count random candidate values'
+        return list(struct.unpack('<%dI'%count, os.urandom(self.size*count)))
+
+    def allocate(self):
+        'Return one unused value'
+        return self.reserve(1)[0]
+
+    def reserve(self, count):
+        'Return a list of count distinct unused values'
+        ret = []
+        while len(ret) < count:
+            for value in self.draw(count - len(ret)):
+                if value in self: continue
+                self.taken.add(value)
+                ret.append(value)
+                continue
+            continue
+        return ret
+
+    def release(self, value):
+        'Allow a value handed out earlier to be handed out again'
+        self.taken.discard(value)
+        return
+
+    pass
+
+class UuidAllocator(IdAllocator):
+    '''
+    Hand out unique entry UUIDs as 32 character hex strings.  The
+    all-zero UUID is reserved for meta stream entries.
+    '''
+
+    size = 16
+    reserved = frozenset(['0'*32])
+
+    def draw(self, count):
+        raw = b2a_hex(os.urandom(self.size*count))
+        step = 2*self.size
+        return [raw[ind:ind+step] for ind in xrange(0, len(raw), step)]
+
+    pass
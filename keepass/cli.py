@@ -19,6 +19,8 @@ class Cli(object):
         'save',                 # save current DB to file
         'dump',                 # dump current DB to text
         'entry',                # add an entry
+        'import',               # add or update entries in bulk
+        'search',               # find entries by keywords
         ]
 
     def __init__(self,args=None):
@@ -127,24 +129,51 @@ class Cli(object):
             continue
 
     def _open_op(self):
-        'open [options] filename'
+        'open [options] filename [filename ...]'
         from optparse import OptionParser
         op = OptionParser(usage=self._open_op.__doc__,add_help_option=False)
         op.add_option('-m','--masterkey',type='string',default="",
                       help='Set master key for decrypting file, default: ""')
+        op.add_option('-p','--policy',type='choice',choices=['newest','ours','theirs'],
+                      default='newest',
+                      help='Set which version of an entry in several files to keep: newest, ours (the earlier file) or theirs (the later file), default: newest')
+        op.add_option('-r','--report',action='store_true',default=False,
+                      help='Print what was done with each entry when merging')
+        op.add_option('-j','--jobs',type='int',default=1,
+                      help='Set how many files to decrypt at once in worker processes, 0 for one per CPU, default: 1')
         return op
 
     def _open(self,opts):
-        'Read a file to the in-memory database'
+        '''Read a file to the in-memory database.  Several files are
+        merged into the first one.'''
         opts,files = self.ops['open'].parse_args(opts)
         import kpdb
-        # fixme - add support for openning/merging multiple DBs!
-        try:
-            dbfile = files[0]
-        except IndexError:
+        if not files:
             print "No database file specified"
             sys.exit(1)
-        self.db = kpdb.Database(files[0],opts.masterkey)
+        if opts.jobs == 1 or len(files) == 1:
+            dbs = [kpdb.Database(dbfile,passphrase=opts.masterkey) for dbfile in files]
+        else:
+            opened = {}
+            failed = False
+            for dbfile,db,error in kpdb.open_many(files,opts.jobs or None,
+                                                  passphrase=opts.masterkey):
+                if error is not None:
+                    sys.stderr.write('%s: %s\n'%(dbfile,error))
+                    failed = True
+                opened[dbfile] = db
+                continue
+            if failed:
+                sys.exit(1)
+            dbs = [opened.pop(dbfile) for dbfile in files if dbfile in opened]
+        self.db = dbs[0]
+        if len(dbs) > 1:
+            import merge
+            self.db,report = merge.merge(dbs,merge.policies[opts.policy])
+            if opts.report:
+                print report
+            else:
+                print 'merged %d files: %s'%(len(dbs),report.summary())
         self.hier = self.db.hierarchy()
         return
 
@@ -154,13 +183,22 @@ class Cli(object):
         op = OptionParser(usage=self._save_op.__doc__,add_help_option=False)
         op.add_option('-m','--masterkey',type='string',default="",
                       help='Set master key for encrypting file, default: ""')
+        op.add_option('-r','--regenerate',action='store_true',default=False,
+                      help='Use fresh master seeds and encryption IV')
+        op.add_option('-t','--unlock-time',type='float',default=None,
+                      help='Calibrate transform rounds to take this many seconds to unlock')
         return op
 
     def _save(self,opts):
         'Save the current in-memory database to a file'
         opts,files = self.ops['save'].parse_args(opts)
         self.db.update(self.hier)
-        self.db.write(files[0],opts.masterkey)
+        if opts.masterkey:
+            self.db.passphrase = opts.masterkey
+        rounds = None
+        if opts.unlock_time:
+            rounds = self.db.calibrate_rounds(opts.unlock_time)
+        self.db.write(files[0],regenerate=opts.regenerate,rounds=rounds)
         return
 
     def _dump_op(self):
@@ -224,6 +262,84 @@ class Cli(object):
                           opts.url,opts.note,opts.imageid,opts.append)
         return
 
+    def _import_op(self):
+        'import [options] [file ...]'
+        from optparse import OptionParser
+        op = OptionParser(usage=self._import_op.__doc__,add_help_option=False)
+        op.add_option('-f','--format',type='choice',choices=['csv','jsonl'],default=None,
+                      help='Set the record format, csv or jsonl, default: guessed from the file name, else csv')
+        op.add_option('-a','--append',action='store_true',default=False,
+                      help='Always add new entries instead of updating those with the same path, title and username')
+        return op
+
+    def _import(self,opts):
+        '''Add or update entries from CSV or JSON Lines records, read
+        from the given files or standard input.  Each record gives a
+        group path and entry fields, eg. for CSV the header line
+        path,title,username,password,url,notes'''
+        opts,files = self.ops['import'].parse_args(opts)
+        if not self.db:
+            sys.stderr.write('Can not import.  No database open.\n')
+            return
+        for filename in files or ['-']:
+            fmt = opts.format
+            if fmt is None:
+                fmt = 'csv'
+                if filename.endswith(('.jsonl','.json')): fmt = 'jsonl'
+            if filename == '-':
+                fp = sys.stdin
+            else:
+                fp = open(filename,'rb')
+            added,updated = self.db.import_entries(read_records(fp,fmt),opts.append)
+            if fp is not sys.stdin:
+                fp.close()
+            print '%s: %d entries added, %d updated'%(filename,added,updated)
+            continue
+        self.hier = self.db.hierarchy()
+        return
+
+    def _search_op(self):
+        'search [options] word [word ...]'
+        from optparse import OptionParser
+        op = OptionParser(usage=self._search_op.__doc__,add_help_option=False)
+        op.add_option('-n','--limit',type='int',default=20,
+                      help='Set the most entries to show, default: 20')
+        return op
+
+    def _search(self,opts):
+        '''Print the entries whose title, username, URL or notes hold
+        all the given words, best match first.  A word ending in '*'
+        matches any word starting with it.'''
+        opts,words = self.ops['search'].parse_args(opts)
+        if not self.db:
+            sys.stderr.write('Can not search.  No database open.\n')
+            return
+        tree = self.db.tree()
+        for score,entry in self.db.search_index().search(' '.join(words),opts.limit):
+            group = self.db.entry_group(entry)
+            path = group and tree.node(group).path() or []
+            print '%6.2f %s: %s %s'%(score,'/'.join(path+[entry.title]),
+                                     entry.username,entry.url)
+            continue
+        return
+
+def read_records(fp,fmt='csv'):
+    '''Generate the records, dictionaries of field names to values,
+    read from the file object in the given format: csv, with a header
+    line naming the fields, or jsonl, one JSON object per line.'''
+    if fmt == 'csv':
+        import csv
+        for record in csv.DictReader(fp):
+            yield record
+        return
+    if fmt == 'jsonl':
+        import json
+        for line in fp:
+            if not line.strip(): continue
+            yield json.loads(line)
+        return
+    raise ValueError,'Unknown record format: "%s"'%fmt
+
 if '__main__' == __name__:
     cliobj = Cli(sys.argv[1:])
     cliobj()
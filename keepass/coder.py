@@ -2,6 +2,12 @@ import struct
 from datetime import datetime
 from binascii import b2a_hex, a2b_hex
 
+# precompiled layouts shared by the coders and the record codecs
+FIELD_HEADER = struct.Struct('<H I')	# field type, field size
+UINT16 = struct.Struct('<H')
+UINT32 = struct.Struct('<I')
+PACKED_TIME = struct.Struct('<5B')
+PACKED_KEY = struct.Struct('>BI')	# packed timestamp as one integer
 
 
 class Coder(object):
@@ -48,47 +54,178 @@ class StringCoder(Coder):
 class AsciiCoder(Coder):
 	@staticmethod
 	def decode(buf):
-		return StringCoder.decode(b2a_hex(buf))
+		# older versions wrote a trailing null after the 16 bytes
+		if len(buf) == 17 and buf[-1] == '\0':
+			buf = buf[:-1]
+		return b2a_hex(buf)
 
 	@staticmethod
 	def encode(val):
-		return StringCoder.encode(a2b_hex(val))
+		return a2b_hex(val)
 
 	
 class ShortCoder(Coder):
 	@staticmethod
 	def decode(buf):
-		return struct.unpack('<H', buf)[0]
+		return UINT16.unpack(buf)[0]
 
 	@staticmethod
 	def encode(val):
-		return struct.pack('<H', int(val))
+		return UINT16.pack(int(val))
 
 
 class IntCoder(Coder):
 	@staticmethod
 	def decode(buf):
-		return struct.unpack('<I', buf)[0]
+		return UINT32.unpack(buf)[0]
 
 	@staticmethod
 	def encode(val):
-		return struct.pack('<I', int(val))
+		return UINT32.pack(int(val))
+
+
+def unpack_datetime(buf):
+	'Return the datetime of a 5 byte packed timestamp'
+	b = PACKED_TIME.unpack(buf)
+	year = (b[0] << 6) | (b[1] >> 2);
+	mon  = ((b[1] & 0b11)     << 2) | (b[2] >> 6);
+	day  = ((b[2] & 0b111111) >> 1);
+	hour = ((b[2] & 0b1)      << 4) | (b[3] >> 4);
+	min  = ((b[3] & 0b1111)   << 2) | (b[4] >> 6);
+	sec  = ((b[4] & 0b111111));
+	return datetime(year, mon, day, hour, min, sec)
+
+def unpack_datetimes(buf):
+	'''Return the list of datetimes of consecutive 5 byte packed
+	timestamps, eg. a time column of columnar.EntryColumns'''
+	data = bytearray(buf)
+	if len(data) % 5:
+		raise struct.error, 'packed timestamps must be 5 bytes each'
+	return [datetime((b0 << 6) | (b1 >> 2),
+			 ((b1 & 0b11) << 2) | (b2 >> 6),
+			 (b2 & 0b111111) >> 1,
+			 ((b2 & 0b1) << 4) | (b3 >> 4),
+			 ((b3 & 0b1111) << 2) | (b4 >> 6),
+			 b4 & 0b111111)
+		for b0, b1, b2, b3, b4 in zip(data[0::5], data[1::5], data[2::5],
+					      data[3::5], data[4::5])]
+
+def packed_keys(buf):
+	'''Return the list of sort keys, see PackedDatetime.key(), of
+	consecutive 5 byte packed timestamps'''
+	data = bytearray(buf)
+	if len(data) % 5:
+		raise struct.error, 'packed timestamps must be 5 bytes each'
+	return [(b0 << 32) | (b1 << 24) | (b2 << 16) | (b3 << 8) | b4
+		for b0, b1, b2, b3, b4 in zip(data[0::5], data[1::5], data[2::5],
+					      data[3::5], data[4::5])]
+
+
+class PackedDatetime(object):
+	'''
+	A timestamp kept in the 5 byte packed form of the file format and
+	converted to a datetime only when one is needed.  Attributes and
+	methods not defined here are those of the datetime.
+
+	The packed form read as a big-endian integer (see key()) is in
+	time order, so PackedDatetime objects compare and sort among
+	themselves without being converted.
+	'''
+
+	__slots__ = ('packed', '_datetime')
+
+	def __init__(self, packed):
+		if len(packed) != PACKED_TIME.size:
+			raise struct.error, 'packed timestamp must be 5 bytes, not %d' % len(packed)
+		self.packed = packed
+		self._datetime = None
+
+	def key(self):
+		'Return the packed form as an integer, which sorts in time order'
+		high, low = PACKED_KEY.unpack(self.packed)
+		return (high << 32) | low
+
+	def asdatetime(self):
+		'Return the timestamp as a datetime'
+		if self._datetime is None:
+			self._datetime = unpack_datetime(self.packed)
+		return self._datetime
+
+	def __getattr__(self, name):
+		if name.startswith('_'):
+			raise AttributeError, name
+		return getattr(self.asdatetime(), name)
+
+	def __str__(self):
+		return str(self.asdatetime())
+
+	def __repr__(self):
+		return 'PackedDatetime(%r)' % self.asdatetime()
+
+	def __hash__(self):
+		# equal datetimes must hash alike
+		return hash(self.asdatetime())
+
+	def _pair(self, other):
+		if isinstance(other, PackedDatetime):
+			return self.key(), other.key()
+		if isinstance(other, datetime):
+			return self.asdatetime(), other
+		return None
+
+	def __eq__(self, other):
+		pair = self._pair(other)
+		if pair is None: return NotImplemented
+		return pair[0] == pair[1]
+
+	def __ne__(self, other):
+		pair = self._pair(other)
+		if pair is None: return NotImplemented
+		return pair[0] != pair[1]
+
+	def __lt__(self, other):
+		pair = self._pair(other)
+		if pair is None: return NotImplemented
+		return pair[0] < pair[1]
+
+	def __le__(self, other):
+		pair = self._pair(other)
+		if pair is None: return NotImplemented
+		return pair[0] <= pair[1]
+
+	def __gt__(self, other):
+		pair = self._pair(other)
+		if pair is None: return NotImplemented
+		return pair[0] > pair[1]
+
+	def __ge__(self, other):
+		pair = self._pair(other)
+		if pair is None: return NotImplemented
+		return pair[0] >= pair[1]
+
+	def __add__(self, other):
+		return self.asdatetime() + other
+
+	__radd__ = __add__
+
+	def __sub__(self, other):
+		if isinstance(other, PackedDatetime):
+			other = other.asdatetime()
+		return self.asdatetime() - other
+
+	def __rsub__(self, other):
+		return other - self.asdatetime()
 
 
 class DatetimeCoder(Coder):
 	@staticmethod
 	def decode(buf):
-		b = struct.unpack('<5B', buf)
-		year = (b[0] << 6) | (b[1] >> 2);
-		mon  = ((b[1] & 0b11)     << 2) | (b[2] >> 6);
-		day  = ((b[2] & 0b111111) >> 1);
-		hour = ((b[2] & 0b1)      << 4) | (b[3] >> 4);
-		min  = ((b[3] & 0b1111)   << 2) | (b[4] >> 6);
-		sec  = ((b[4] & 0b111111));
-		return datetime(year, mon, day, hour, min, sec)
+		return PackedDatetime(buf)
 
 	@staticmethod
 	def encode(val):
+		if isinstance(val, PackedDatetime):
+			return val.packed
 		year, mon, day, hour, min, sec = val.timetuple()[:6]
 		b0 = 0x0000FFFF & ( (year>>6)&0x0000003F )
 		b1 = 0x0000FFFF & ( ((year&0x0000003f)<<2) | ((mon>>2) & 0x00000003) )
@@ -96,5 +233,5 @@ class DatetimeCoder(Coder):
 			| ((hour>>4)&0x00000001) )
 		b3 = 0x0000FFFF & ( ((hour&0x0000000F)<<4) | ((min>>2)&0x0000000F) )
 		b4 = 0x0000FFFF & ( (( min&0x00000003)<<6) | (sec&0x0000003F))
-		return struct.pack('<5B',b0,b1,b2,b3,b4)
+		return PACKED_TIME.pack(b0,b1,b2,b3,b4)
 
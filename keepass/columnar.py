@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+'''
+Column-wise storage of entries for very large databases.
+
+Instead of one EntryInfo object per entry, EntryColumns keeps each
+field of all entries together:
+
+ * integer fields (groupid, imageid) in array('I') columns
+ * packed timestamps and UUIDs in fixed width bytearray columns
+ * all other fields as raw field data in one contiguous bytearray
+   with array('I') offset and length columns per field
+
+Values are decoded only when asked for, one at a time through
+EntryRow views, which look like read-only EntryInfo objects, or a
+whole column at a time through EntryColumns.column().
+
+The few records which have fields of unknown type or their fields
+out of the canonical order are also kept whole, and encoded as they
+were read, so that writing the columns loses nothing.
+'''
+
+from array import array
+
+from coder import FIELD_HEADER, UINT32, DatetimeCoder, \
+    unpack_datetimes, packed_keys
+from infoblock import EntryInfo, walk
+
+class EntryRow(object):
+    '''
+    A read-only view of one entry of an EntryColumns.
+    '''
+
+    __slots__ = ('_columns', '_row')
+
+    format = EntryInfo.format
+
+    def __init__(self, columns, row):
+        object.__setattr__(self, '_columns', columns)
+        object.__setattr__(self, '_row', row)
+        return
+
+    def __getattr__(self, name):
+        return self._columns.value(self._row, name)
+
+    def __setattr__(self, name, value):
+        raise AttributeError, 'EntryRow is read-only, see EntryColumns.to_entries()'
+
+    def __str__(self):
+        ret = ['EntryInfo:']
+        for name in self._columns.names:
+            ret.append('\t%s %s'%(name, getattr(self, name)))
+            continue
+        return '\n'.join(ret)
+
+    def __len__(self):
+        return len(self.encode())
+
+    def name(self):
+        'Return the title'
+        return self.title
+
+    def asdict(self):
+        'Return a dictionary mapping field names to their values'
+        return dict((name, getattr(self, name)) for name in self._columns.names)
+
+    def encode(self):
+        return self._columns.encode_row(self._row)
+
+    def entry(self):
+        'Return a new EntryInfo holding this row'
+        return EntryInfo(self.encode())
+
+    pass
+
+class EntryColumns(object):
+    '''
+    Column-wise storage of entries, see module documentation.
+    '''
+
+    int_fields = ('groupid', 'imageid')
+    fixed_fields = {'uuid':16, 'creation_time':5, 'last_mod_time':5,
+                    'last_acc_time':5, 'expiration_time':5}
+
+    def __init__(self):
+        self.types = {}         # field name -> type
+        self.coders = {}        # field name -> coder
+        self.defaults = {}      # field name -> raw data used if missing
+        self.names = []
+        for typ, (name, coder, default) in EntryInfo.format.iteritems():
+            if name is None or name == 'ignored': continue
+            self.names.append(name)
+            self.types[name] = typ
+            self.coders[name] = coder
+            if default is None:
+                self.defaults[name] = ''
+            else:
+                self.defaults[name] = coder.encode(default())
+            continue
+
+        self.ints = dict((name, array('I')) for name in self.int_fields)
+        self.fixed = dict((name, bytearray()) for name in self.fixed_fields)
+        self.strings = bytearray()
+        self.offsets = {}
+        self.lengths = {}
+        for name in self.names:
+            if name in self.ints or name in self.fixed: continue
+            self.offsets[name] = array('I')
+            self.lengths[name] = array('I')
+            continue
+        self.verbatim = {}      # row -> binary record of unusual layout
+        self.count = 0
+        return
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, row):
+        if row < 0: row += self.count
+        if not 0 <= row < self.count:
+            raise IndexError, 'entry row out of range'
+        return EntryRow(self, row)
+
+    def __iter__(self):
+        for row in xrange(self.count):
+            yield EntryRow(self, row)
+        return
+
+    def _append_raw(self, raw):
+        'Append one entry given a map from field name to raw field data'
+        for name in self.names:
+            buf = raw.get(name)
+            if buf is None:
+                buf = self.defaults[name]
+            if name in self.ints:
+                self.ints[name].append(UINT32.unpack(buf)[0])
+            elif name in self.fixed:
+                size = self.fixed_fields[name]
+                if len(buf) != size:
+                    buf = self.coders[name].encode(self.coders[name].decode(buf))
+                self.fixed[name].extend(buf)
+            else:
+                self.offsets[name].append(len(self.strings))
+                self.lengths[name].append(len(buf))
+                self.strings.extend(buf)
+            continue
+        self.count += 1
+        return
+
+    def append_record(self, string, offset=0):
+        '''Append the entry encoded at offset in the binary string or
+        buffer.  Return the offset just past it.'''
+        view = memoryview(string)
+        format = EntryInfo.format
+        ranks = EntryInfo._ranks
+        canonical = True
+        last = -1
+        raw = {}
+        for typ, siz, index in walk(view, offset):
+            rank = ranks.get(typ, -1)
+            if canonical:
+                canonical = rank > last
+                last = rank
+            if typ == 0xFFFF: break
+            if rank < 0: continue
+            raw[format[typ][0]] = view[index:index+siz].tobytes()
+            continue
+        end = index + siz
+        if not canonical:
+            self.verbatim[self.count] = view[offset:end].tobytes()
+        self._append_raw(raw)
+        return end
+
+    def append(self, entry):
+        'Append an EntryInfo (or EntryRow)'
+        raw = {}
+        for name in self.names:
+            try:
+                value = getattr(entry, name)
+            except AttributeError:
+                continue
+            raw[name] = self.coders[name].encode(value)
+            continue
+        if getattr(entry, '_order', None) or getattr(entry, '_extra', None):
+            self.verbatim[self.count] = entry.encode()
+        self._append_raw(raw)
+        return
+
+    def raw(self, row, name):
+        'Return the raw field data of the given row'
+        if name in self.fixed:
+            size = self.fixed_fields[name]
+            return str(self.fixed[name][row*size:(row+1)*size])
+        offset = self.offsets[name][row]
+        return str(self.strings[offset:offset+self.lengths[name][row]])
+
+    def value(self, row, name):
+        'Return the decoded value of the named field in the given row'
+        if name in self.ints:
+            return self.ints[name][row]
+        if name not in self.coders:
+            raise AttributeError, name
+        return self.coders[name].decode(self.raw(row, name))
+
+    def column(self, name):
+        '''Return a list of the decoded values of the named field.
+        Timestamps are converted to datetimes all in one pass.'''
+        if name in self.ints:
+            return self.ints[name].tolist()
+        if isinstance(self.coders.get(name), DatetimeCoder):
+            return unpack_datetimes(self.fixed[name])
+        return [self.value(row, name) for row in xrange(self.count)]
+
+    def order(self, name, reverse=False):
+        '''Return the list of rows sorted by the named field.
+        Timestamps are sorted by their packed form, without decoding.'''
+        if isinstance(self.coders.get(name), DatetimeCoder):
+            keys = packed_keys(self.fixed[name])
+        else:
+            keys = self.column(name)
+        return sorted(xrange(self.count), key=keys.__getitem__, reverse=reverse)
+
+    def encode_row(self, row):
+        'Return the binary record of the given row'
+        if row in self.verbatim:
+            return self.verbatim[row]
+        pack = FIELD_HEADER.pack
+        pieces = [pack(0, 0)]
+        for name in self.names:
+            if name in self.ints:
+                buf = UINT32.pack(self.ints[name][row])
+            else:
+                buf = self.raw(row, name)
+            pieces.append(pack(self.types[name], len(buf)))
+            pieces.append(buf)
+            continue
+        pieces.append(pack(0xFFFF, 0))
+        return ''.join(pieces)
+
+    def to_entries(self):
+        'Return a list of EntryInfo objects, one per row'
+        return [EntryInfo(self.encode_row(row)) for row in xrange(self.count)]
+
+    pass
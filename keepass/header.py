@@ -101,17 +101,16 @@ class DBHDR(object):
             continue
         return ret
 
-    def decode(self,buf):
-        'Fill self from binary string.'
+    def decode(self,buf,offset=0):
+        'Fill self from binary string or buffer, starting at offset.'
         import struct
 
-        index = 0
+        index = offset
 
         for field in DBHDR.format:
             name,nbytes,typecode = field
-            string = buf[index:index+nbytes]
+            value = struct.unpack_from('<'+typecode, buf, index)[0]
             index += nbytes
-            value = struct.unpack('<'+typecode, string)[0]
             self.__dict__[name] = value
             continue
 
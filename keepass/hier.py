@@ -3,11 +3,14 @@
 Classes to construct a hiearchy holding infoblocks.
 '''
 
+from collections import OrderedDict
+from fnmatch import fnmatchcase
+
 def path2list(path):
     '''
     Maybe convert a '/' separated string into a list.
     '''
-    if isinstance(path,str): 
+    if isinstance(path,basestring): 
         path = path.split('/')
         if path[-1] == '': path.pop() # remove trailing '/'
         return path
@@ -54,41 +57,34 @@ class NodeDumper(Walker):
     def __call__(self,node):
         if not node.group:
             print 'Top'
-            return
-        print '  '*node.level*2,node.group.name(),node.group.groupid,\
+            return (None,None)
+        print '  '*node.depth()*2,node.group.name(),node.group.groupid,\
             len(node.entries),len(node.nodes)
+        return (None,None)
 
 class FindGroupNode(object):
     '''Return the node holding the group of the given name.  If name
     has any slashes it will be interpreted as a path ending in that
     group'''
-    def __init__(self,path):
+    def __init__(self,path,stop_on_first = True):
         self._collected = []
         self.best_match = None
+        self.stop_on_first = stop_on_first
         self.path = path2list(path)
-        print 'Finding path',path
         return
 
     def __call__(self,node):
         if not self.path: 
-            print 'Bailing, no path'
             return (None,True)
         if not node.group:
             if self.path[0] == "" or self.path[0] == "None" or self.path[0] is None:
                 self.path.pop(0)
-            print 'Skipping node with null group.'
             return (None,None)
 
         top_name = self.path[0]
-        obj_name = group.name()
-
-        groupid = node.group.groupid
-        print self.path,obj_name,groupid
-
-        from infoblock import GroupInfo
+        obj_name = node.group.name()
 
         if top_name != obj_name:
-            print top_name,'!=',obj_name
             return (None,True) # bail on the current node
 
         self.best_match = node
@@ -202,21 +198,102 @@ class Node(object):
     Holds:
 
      * zero or one group - zero implies top of hierarchy
+     * zero or one parent node - zero for the top
      * zero or more nodes
      * zero or more entries
+
+    The child nodes are also kept by group name and the entries by
+    title, making each node one level of a trie of paths.  Use the
+    add_*() and remove_*() methods for these to stay correct; a
+    hier.Tree also follows renames.  Child nodes and entries are held
+    in order by their id(), in the lists and in each bucket, so that
+    removing one takes constant time.
     '''
 
-    def __init__(self,group=None,entries=None,nodes=None):
+    def __init__(self,group=None,entries=None,nodes=None,parent=None):
         self.group = group
-        self.nodes = nodes or list()
-        self.entries = entries or list()
+        self.parent = parent
+        self._nodes = OrderedDict()     # id(node) -> child node
+        self._entries = OrderedDict()   # id(entry) -> entry
+        self.children = {}      # group name -> {id(node): child node}
+        self.titles = {}        # entry title -> {id(entry): entry}
+        for node in nodes or ():
+            self.add_node(node)
+            continue
+        for entry in entries or ():
+            self.add_entry(entry)
+            continue
         return
 
+    @property
+    def nodes(self):
+        'The list of child nodes, in order'
+        return self._nodes.values()
+
+    @property
+    def entries(self):
+        'The list of entries, in order'
+        return self._entries.values()
+
     def level(self):
         'Return the level of the group or -1 if have no group'
         if self.group: return self.group.level
         return -1
 
+    def depth(self):
+        '''Return the level this node's group has in the hierarchy, -1
+        for the top, counting parent nodes'''
+        depth = -1
+        node = self
+        while node.parent is not None:
+            depth += 1
+            node = node.parent
+            continue
+        return depth
+
+    def path(self):
+        'Return the list of group names from the top down to this node'
+        names = []
+        node = self
+        while node is not None and node.group is not None:
+            names.append(node.group.group_name)
+            node = node.parent
+            continue
+        names.reverse()
+        return names
+
+    def child(self,name):
+        'Return the first child node whose group has the given name or None'
+        found = self.children.get(name)
+        if found: return next(found.itervalues())
+        return None
+
+    def add_node(self,node):
+        'Make node the last child of this node and return it'
+        node.parent = self
+        self._nodes[id(node)] = node
+        bucket(self.children, node.name(), node)
+        return node
+
+    def remove_node(self,node):
+        'Remove the child node'
+        self._nodes.pop(id(node), None)
+        unbucket(self.children, node.name(), node)
+        node.parent = None
+        return
+
+    def add_entry(self,entry):
+        'Add the entry to this node'
+        self._entries[id(entry)] = entry
+        bucket(self.titles, entry.title, entry)
+        return
+
+    def remove_entry(self,entry):
+        'Remove the entry from this node'
+        self._entries.pop(id(entry), None)
+        unbucket(self.titles, entry.title, entry)
+        return
+
     def __str__(self):
         return self.pretty()
 
@@ -258,6 +335,263 @@ class Node(object):
     pass
 
 
+class Tree(object):
+    '''
+    A group hierarchy kept in step with the flat lists of groups and
+    entries of a database.
+
+    The tree is built once from the groups, in file order with their
+    levels, and the entries.  After that it is changed in place by
+    add_group(), remove_group(), move_group(), add_entry() and
+    remove_entry(), each of which costs about the depth of the group
+    concerned.  Like index.Index it listens to its records, so that
+    setting the groupid of an entry moves the entry to its new group.
+
+    These methods leave the lists to the caller, who keeps them (see
+    kpdb.Database).  The file format needs the groups listed in
+    pre-order with each group's level set, which order() produces
+    when the tree has changed shape.
+    '''
+
+    def __init__(self,groups,entries):
+        self.groups = groups
+        self.entries = entries
+        self.top = Node()
+        self.nodes = {}         # groupid -> Node
+        self.ordered = True     # whether the groups list follows the tree
+
+        breadcrumb = [self.top]
+        for group in groups:
+            # breadcrumb[ind] is at level ind-1
+            while len(breadcrumb) > 1 and len(breadcrumb)-1 > group.level:
+                breadcrumb.pop()
+                continue
+            node = breadcrumb[-1].add_node(Node(group))
+            self.nodes.setdefault(group.groupid, node)
+            breadcrumb.append(node)
+            group.add_listener(self)
+            continue
+
+        for entry in entries:
+            self._node_of(entry).add_entry(entry)
+            entry.add_listener(self)
+            continue
+
+        self.ngroups = len(groups)
+        self.nentries = len(entries)
+        return
+
+    def _node_of(self,entry):
+        # entries of unknown groups are kept at the top
+        return self.nodes.get(entry.groupid, self.top)
+
+    def current(self,groups,entries):
+        'Return True if this tree still describes the given lists'
+        return groups is self.groups and entries is self.entries and \
+            len(groups) == self.ngroups and len(entries) == self.nentries
+
+    def node(self,group):
+        'Return the node holding the group, the top one for None'
+        if group is None: return self.top
+        return self.nodes[group.groupid]
+
+    def find(self,path):
+        '''Return the node at the given path, a list of group names or
+        a '/' separated string, or None.  Of groups with the same name
+        the first is taken.'''
+        node = self.top
+        for name in path2list(path):
+            if not name: continue
+            node = node.child(name)
+            if node is None: break
+            continue
+        return node
+
+    def lookup(self,path):
+        '''Return the list of the groups and entries at the given path,
+        eg. "/Servers/Prod/db01", all of them if names are repeated.
+        The last name is matched against both group names and entry
+        titles.'''
+        return self._resolve(path, _exact)
+
+    def glob(self,pattern):
+        '''Return the list of the groups and entries matching the given
+        path pattern, eg. "/Servers/*/db*", where each name may use the
+        wildcards of the fnmatch module.'''
+        return self._resolve(pattern, _matching)
+
+    def _resolve(self,path,match):
+        names = [name for name in path2list(path) if name]
+        if not names: return []
+        nodes = [self.top]
+        for name in names[:-1]:
+            nodes = [child for node in nodes for child in match(node.children, name)]
+            continue
+        ret = []
+        for node in nodes:
+            ret.extend(child.group for child in match(node.children, names[-1]))
+            ret.extend(match(node.titles, names[-1]))
+            continue
+        return ret
+
+    def add_group(self,group,parent=None):
+        'Add the group as the last child of the group parent and return its node'
+        parent = self.node(parent)
+        group.level = parent.depth() + 1
+        node = parent.add_node(Node(group))
+        self.nodes[group.groupid] = node
+        group.add_listener(self)
+        self.ngroups += 1
+        if parent is not self.top:
+            self.ordered = False
+        return node
+
+    def remove_group(self,group):
+        '''Remove the group and everything below it from the tree.
+        Return the list of removed groups, the given one first, and
+        the list of removed entries.'''
+        node = self.nodes[group.groupid]
+        node.parent.remove_node(node)
+        groups = []
+        entries = []
+        for sub in iter_nodes(node):
+            groups.append(sub.group)
+            entries.extend(sub.entries)
+            if self.nodes.get(sub.group.groupid) is sub:
+                del self.nodes[sub.group.groupid]
+            continue
+        for record in groups + entries:
+            record.remove_listener(self)
+            continue
+        self.ngroups -= len(groups)
+        self.nentries -= len(entries)
+        return groups, entries
+
+    def move_group(self,group,parent=None):
+        'Make the group, with all below it, the last child of the group parent'
+        node = self.nodes[group.groupid]
+        parent = self.node(parent)
+        above = parent
+        while above is not None:
+            if above is node:
+                raise ValueError, 'can not move group "%s" below itself' % group.group_name
+            above = above.parent
+            continue
+        node.parent.remove_node(node)
+        parent.add_node(node)
+        self.ordered = False
+        return
+
+    def add_entry(self,entry):
+        'Add the entry to the node of its group'
+        self._node_of(entry).add_entry(entry)
+        entry.add_listener(self)
+        self.nentries += 1
+        return
+
+    def remove_entry(self,entry):
+        'Remove the entry from the node of its group'
+        self._node_of(entry).remove_entry(entry)
+        entry.remove_listener(self)
+        self.nentries -= 1
+        return
+
+    def changed(self,record,field,old,new):
+        'Called by a record when one of its attributes is set'
+        if old == new: return
+        from infoblock import GroupInfo
+        if not isinstance(record, GroupInfo):
+            if field == 'title':
+                node = self._node_of(record)
+                unbucket(node.titles, old, record)
+                bucket(node.titles, new, record)
+            elif field == 'groupid':
+                self.nodes.get(old, self.top).remove_entry(record)
+                self._node_of(record).add_entry(record)
+            return
+
+        node = self.nodes.get(record.groupid if field != 'groupid' else old)
+        if node is None or node.group is not record: return
+        if field == 'group_name':
+            unbucket(node.parent.children, old, node)
+            bucket(node.parent.children, new, node)
+        elif field == 'groupid':
+            del self.nodes[old]
+            self.nodes[new] = node
+            # the entries no longer belong to the group
+            orphans = [entry for entry in node.entries if entry.groupid == old]
+            for entry in orphans:
+                node.remove_entry(entry)
+                self.top.add_entry(entry)
+                continue
+        return
+
+    def order(self):
+        '''Return the groups in the pre-order the file format needs,
+        setting the level of each from the tree'''
+        ret = []
+        stack = [(node, 0) for node in reversed(self.top.nodes)]
+        while stack:
+            node, level = stack.pop()
+            if node.group.level != level:
+                node.group.level = level
+            ret.append(node.group)
+            stack.extend((child, level+1) for child in reversed(node.nodes))
+            continue
+        return ret
+
+    def detach(self):
+        'Stop listening to all records'
+        for record in self.groups + self.entries:
+            record.remove_listener(self)
+            continue
+        return
+
+    pass
+
+
+def bucket(table,key,record):
+    'Add the record last to the bucket table[key], made if need be'
+    found = table.get(key)
+    if found is None:
+        found = table[key] = OrderedDict()
+    found[id(record)] = record
+    return
+
+def unbucket(table,key,record):
+    'Remove the record from the bucket table[key], dropping it once empty'
+    found = table.get(key)
+    if not found: return
+    found.pop(id(record), None)
+    if not found:
+        del table[key]
+    return
+
+def _exact(table,name):
+    found = table.get(name)
+    if not found: return ()
+    return found.values()
+
+def _matching(table,pattern):
+    if not any(char in pattern for char in '*?['):
+        return _exact(table, pattern)
+    ret = []
+    for name in sorted(table):
+        if fnmatchcase(name, pattern):
+            ret.extend(table[name].itervalues())
+        continue
+    return ret
+
+def iter_nodes(node):
+    'Generate the node and all nodes below it in pre-order'
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        yield node
+        stack.extend(reversed(node.nodes))
+        continue
+    return
+
 def visit(node,visitor):
     '''
     Depth-first descent into the group/entry hierarchy.
@@ -293,7 +627,7 @@ def walk(node,walker):
     if value is not None or bail: return value
 
     for sn in node.nodes:
-        value,bail = walk(sn,walker)
+        value = walk(sn,walker)
         if value is not None: return value
         continue
     return None    
@@ -301,44 +635,27 @@ def walk(node,walker):
 
 def groupid(top):
     'Return group ID unique to groups in nodes below top'
-    
-    
+    from alloc import IdAllocator
+    used = set(node.group.groupid for node in iter_nodes(top) if node.group)
+    return IdAllocator(used).allocate()
 
 def mkdir(top,path):
     '''
     Starting at given top node make nodes and groups to satisfy the
     given path, where needed.  Return the node holding the leaf group.
+    See Database.mkdir() for doing so in a database.
     '''
     import infoblock
 
-    path = path2list(path)
-    pathlen = len(path)
-    print 'mkdir',path
-
-    fg = FindGroupNode(path)
-    node = walk(top,fg)
-
-    if not node:                # make remaining intermediate folders
-        print 'Remaining folders to make:',fg.path
-        node = fg.best_match
-        pathlen -= len(fg.path)
-        for group_name in fg.path:
-            # fixme, this should be moved into a new constructor
-            new_group = infoblock.GroupInfo()
-            new_group.groupid = top.gen_groupid()
-            new_group.group_name = group_name
-            new_group.imageid = 1
-            new_group.level = pathlen
-            pathlen += 1
-            
-            new_node = hier.Node(new_group)
-            node.nodes.append(new_node)
-            
-            node = new_node
-            group = new_group
-            continue
-        pass
+    node = top
+    for group_name in path2list(path):
+        if not group_name: continue
+        child = node.child(group_name)
+        if child is None:
+            new_group = infoblock.GroupInfo(
+                groupid=groupid(top), group_name=group_name,
+                imageid=1, level=node.depth()+1)
+            child = node.add_node(Node(new_group))
+        node = child
+        continue
     return node
-    
-
-    
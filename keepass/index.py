@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+'''
+Secondary indexes over GroupInfo and EntryInfo records.
+
+An Index maps the values of fields to the records holding them.  A
+field is only indexed once it is first looked up, so that lazily
+decoded records (see infoblock.LazyEntryInfo) only decode the fields
+asked for.  Each value's bucket maps id(record) to the record, so
+records leave it in constant time; lookups return a bucket's records
+in list order.  The index registers itself with each record it holds so that setting
+an indexed attribute on a record moves the record to its new bucket.
+Records must be added and removed through the index (or the Database
+methods using it) for it to stay correct.
+'''
+
+class Index(object):
+    '''
+    Maintained hash indexes over a list of records.
+
+    The index shares the given list and keeps it in step with its
+    insert() and remove() methods.  Lookups on fields which are not
+    yet indexed build an index for that field first, as may the
+    fields given.
+    '''
+
+    def __init__(self, records, fields=()):
+        self.records = records
+        self.tables = {}
+        self.position = {}
+        for ind, record in enumerate(records):
+            self.position[id(record)] = ind
+            record.add_listener(self)
+            continue
+        for field in fields:
+            self.add_field(field)
+            continue
+        return
+
+    def __len__(self):
+        return len(self.position)
+
+    def current(self, records):
+        'Return True if this index still describes the given list'
+        return records is self.records and len(records) == len(self.position)
+
+    def add_field(self, field):
+        'Index the given field of all records'
+        table = {}
+        for record in self.records:
+            table.setdefault(getattr(record, field, None), {})[id(record)] = record
+            continue
+        self.tables[field] = table
+        return table
+
+    def table(self, field):
+        '''Return the map from the values of the field to the buckets of
+        the records holding them, indexing the field if need be'''
+        table = self.tables.get(field)
+        if table is None:
+            table = self.add_field(field)
+        return table
+
+    def lookup(self, field, value):
+        'Return a list of the records whose field has the given value'
+        bucket = self.table(field).get(value)
+        if not bucket:
+            return []
+        if len(bucket) == 1:
+            return bucket.values()
+        position = self.position
+        return sorted(bucket.itervalues(), key=lambda record: position[id(record)])
+
+    def find(self, **fields):
+        'Return a list of records matching all the given field values'
+        best = None
+        for field, value in fields.iteritems():
+            found = self.lookup(field, value)
+            if best is None or len(found) < len(best):
+                best = found
+            continue
+        if best is None:
+            return list(self.records)
+        return [record for record in best
+                if all(getattr(record, field, None) == value
+                       for field, value in fields.iteritems())]
+
+    def insert(self, record):
+        'Append the record to the list and index it'
+        self.position[id(record)] = len(self.records)
+        self.records.append(record)
+        record.add_listener(self)
+        for field, table in self.tables.iteritems():
+            table.setdefault(getattr(record, field, None), {})[id(record)] = record
+            continue
+        return
+
+    def remove(self, record, keep_order=False):
+        '''Remove the record from the list and the index.  Unless
+        keep_order is True the last record of the list takes the place
+        of the removed one, which avoids shifting the rest of the list.'''
+        ind = self.position.pop(id(record))
+        if keep_order:
+            del self.records[ind]
+            for other in self.records[ind:]:
+                self.position[id(other)] -= 1
+                continue
+        else:
+            last = self.records.pop()
+            if last is not record:
+                self.records[ind] = last
+                self.position[id(last)] = ind
+        record.remove_listener(self)
+        for field, table in self.tables.iteritems():
+            self._unbucket(table, getattr(record, field, None), record)
+            continue
+        return
+
+    def remove_all(self, records):
+        '''Remove the records from the list and the index, keeping the
+        order of the rest, in one pass over the list'''
+        gone = set(id(record) for record in records)
+        self.records[:] = [record for record in self.records if id(record) not in gone]
+        self.position = dict((id(record), ind) for ind, record in enumerate(self.records))
+        for record in records:
+            record.remove_listener(self)
+            for field, table in self.tables.iteritems():
+                self._unbucket(table, getattr(record, field, None), record)
+                continue
+            continue
+        return
+
+    def reorder(self, order):
+        'Put the records of the list in the given order'
+        self.records[:] = order
+        self.position = dict((id(record), ind) for ind, record in enumerate(self.records))
+        return
+
+    def detach(self):
+        'Stop listening to all records'
+        for record in self.records:
+            record.remove_listener(self)
+            continue
+        self.tables = {}
+        self.position = {}
+        return
+
+    def changed(self, record, field, old, new):
+        'Called by a record when one of its attributes is set'
+        table = self.tables.get(field)
+        if table is None or old == new: return
+        self._unbucket(table, old, record)
+        table.setdefault(new, {})[id(record)] = record
+        return
+
+    def _unbucket(self, table, value, record):
+        bucket = table.get(value)
+        if not bucket: return
+        bucket.pop(id(record), None)
+        if not bucket:
+            del table[value]
+        return
+
+    pass
@@ -10,100 +10,258 @@ from random import randrange
 from coder import *
 
 
-class InfoBase(object):
-    'Base class for info type blocks'
+def walk(string, offset=0):
+    '''Generate (type, size, data offset) for each field of the record
+    starting at offset in the binary string or buffer, ending with the
+    terminator field.  No field data is copied.'''
+    while True:
+        typ, siz = FIELD_HEADER.unpack_from(string, offset)
+        offset += 6
+        yield typ, siz, offset
+        if typ == 0xFFFF: return
+        offset += siz
+        continue
+
+def record_end(string, offset=0):
+    '''Return the offset just past the record starting at offset in the
+    binary string or buffer, or None if it ends before the record does.'''
+    length = len(string)
+    while offset + 6 <= length:
+        typ, siz = FIELD_HEADER.unpack_from(string, offset)
+        offset += 6 + siz
+        if typ != 0xFFFF: continue
+        if offset > length: break
+        return offset
+    return None
+
+
+def slots(format):
+    'Return the slot names for the fields of the given format'
+    return tuple(item[0] for item in format.itervalues() if item[0] is not None)
+
+def ranks(format):
+    'Return a map from field type to its position in the canonical layout'
+    return dict((typ, ind) for ind, typ in enumerate(format))
+
+def current_time():
+    'Return the current time to the second, as kept by the file format'
+    return datetime.now().replace(microsecond=0)
+
+def codecs(format):
+    '''Return a map from field type to (name, decode, encode, default)
+    for the fields of the given format.  Looking up the coder functions
+    once per class saves doing so for every field of every record.'''
+    return dict((typ, (name, coder.decode, coder.encode, default))
+                for typ, (name, coder, default) in format.iteritems()
+                if name is not None)
+
 
-    def __init__(self, format, string=None):
-        self.format = format
-        self.order = []
+class InfoBase(object):
+    '''
+    Base class for info type blocks.
+
+    Subclasses give the field layout as their format, with its
+    codecs(), and hold the field values in slots of the same names,
+    see slots().  The order in which fields were read, and the raw
+    data of fields of unknown type, are only kept when they differ
+    from the canonical layout.
+    '''
+
+    __slots__ = (
+        '_listeners',           # objects told of attribute changes
+        '_length',              # length of the record as read
+        '_order',               # field types as read, if not canonical
+        '_extra',               # type -> raw data of unknown fields
+        )
+
+    def __init__(self, string=None, offset=0, **fields):
+        '''Decode the record at offset in the binary string or buffer,
+        or else make a new record from the given field values and the
+        defaults of the format for the fields not given.'''
+        set_field = object.__setattr__
+        set_field(self, '_listeners', ())
+        set_field(self, '_order', None)
+        set_field(self, '_extra', None)
         if string:
-            self.decode(string)
-        else:
-            string = self.encode(set_default=True)
-            self.decode(string)
+            self.decode(string, offset)
+            return
+        for name, coder, default in self.format.itervalues():
+            if name is None: continue
+            if name in fields:
+                value = fields.pop(name)
+            elif default is None:
+                value = None
+            else:
+                value = default()
+            set_field(self, name, value)
+            continue
+        if fields:
+            raise TypeError, 'unknown %s fields: %s' % \
+                (self.__class__.__name__, ', '.join(sorted(fields)))
         return
 
     def __str__(self):
         ret = [self.__class__.__name__ + ':']
         for num,form in self.format.iteritems():
+            if form[0] is None: continue
             try:
-                value = self.__dict__[form[0]]
-            except KeyError:
+                value = getattr(self, form[0])
+            except AttributeError:
                 continue
             ret.append('\t%s %s'%(form[0], value))
         return '\n'.join(ret)
 
-    def __len__(self):
-        length = 0
-        for typ,siz in self.order:
-            length += 2+4+siz
-        return length
-
-    def decode(self, string):
-        'Fill self from binary string'
-        index = 0
-        while True:
-            substr = string[index:index+6]
-            index += 6
+    def __setattr__(self, name, value):
+        if not self._listeners:
+            object.__setattr__(self, name, value)
+            return
+        old = getattr(self, name, None)
+        object.__setattr__(self, name, value)
+        for listener in self._listeners:
+            listener.changed(self, name, old, value)
+            continue
+        return
 
-            typ, siz = struct.unpack('<H I', substr)
-            self.order.append((typ, siz))
+    def add_listener(self, listener):
+        '''Call listener.changed(self, name, old, new) whenever an
+        attribute is set'''
+        if listener not in self._listeners:
+            object.__setattr__(self, '_listeners', self._listeners + (listener,))
+        return
 
-            substr = string[index:index+siz]
-            index += siz
+    def remove_listener(self, listener):
+        'Stop telling listener of attribute changes'
+        listeners = tuple(l for l in self._listeners if l is not listener)
+        object.__setattr__(self, '_listeners', listeners)
+        return
 
-            name, coder, default = self.format[typ]
-            buf = struct.unpack('<%ds'%siz, substr)[0]
+    def asdict(self):
+        'Return a dictionary mapping field names to their values'
+        ret = {}
+        for typ, item in self.format.iteritems():
+            if item[0] is None: continue
+            try:
+                ret[item[0]] = getattr(self, item[0])
+            except AttributeError:
+                continue
+        return ret
 
-            if name is None: break
+    def __len__(self):
+        try:
+            return self._length
+        except AttributeError:
+            return len(self.encode())
+
+    def _canonical(self, types):
+        'Return True if the field types read follow the canonical layout'
+        last = -1
+        for typ in types:
+            rank = self._ranks.get(typ)
+            if rank is None or rank <= last: return False
+            last = rank
+            continue
+        return True
+
+    def decode(self, string, offset=0):
+        '''Fill self from the record starting at offset in the binary
+        string or buffer.  Return the offset just past the record.'''
+        if isinstance(string, str):
+            view = string       # slicing copies just once
+        else:
+            view = memoryview(string)
+        codecs = self._codecs
+        ranks = self._ranks
+        unpack_from = FIELD_HEADER.unpack_from
+        set_field = object.__setattr__
+        canonical = True
+        last = -1
+        extra = None
+        index = offset
+        while True:
+            typ, siz = unpack_from(view, index)
+            index += 6
+            if canonical:
+                rank = ranks.get(typ, -1)
+                canonical = rank > last
+                last = rank
+            if typ == 0xFFFF: break
+
+            buf = view[index:index+siz]
+            if view is not string:
+                buf = buf.tobytes()
+            index += siz
+            try:
+                name, decode, encode, default = codecs[typ]
+            except KeyError:
+                if extra is None: extra = {}
+                extra[typ] = buf
+                continue
 
             try:
-                value = coder.decode(buf)
+                value = decode(buf)
             except struct.error,msg:
                 msg = '%s, typ = %d[%d] -> %s buf = "%s"'%\
                     (msg,typ,siz,self.format[typ], buf)
                 raise struct.error, msg
 
-            self.__dict__[name] = value
+            set_field(self, name, value)
             continue
-        return
 
-    def encode(self, set_default=False):
-        string = ""
-        for typ, item in self.format.items():
-            name = item[0]
-            coder = item[1]
-            default = item[2]
+        end = index + siz
+        set_field(self, '_length', end - offset)
+        types = None
+        if not canonical:
+            types = tuple(typ for typ, siz, index in walk(view, offset))
+        set_field(self, '_order', types)
+        set_field(self, '_extra', extra)
+        return end
+
+    def _types(self):
+        'Return the field types to encode, in order'
+        if self._order is None:
+            types = list(self.format)
+            if self._extra:
+                types[-1:-1] = sorted(self._extra)
+            return types
+        types = [typ for typ in self._order if typ != 0xFFFF]
+        types += [typ for typ in self.format if typ not in self._order and typ != 0xFFFF]
+        types.append(0xFFFF)
+        return types
 
+    def encode(self, set_default=False):
+        codecs = self._codecs
+        pack = FIELD_HEADER.pack
+        pieces = []
+        for typ in self._types():
             if typ == 0xFFFF:
-                encoded = None
+                pieces.append(pack(typ, 0))
+                continue
+            try:
+                name, decode, encode, default = codecs[typ]
+            except KeyError:
+                encoded = self._extra[typ]
             else:
-                if hasattr(self, name):
-                    value = self.__dict__[name]
-                else:
+                try:
+                    value = getattr(self, name)
+                except AttributeError:
                     if default is None:
                         value = None
                     else:
                         value = default()
-                encoded = coder.encode(value)
-            
+                encoded = encode(value)
+
             if encoded is None:
-                siz = 0
-            else:
-                siz = len(encoded)
+                pieces.append(pack(typ, 0))
+                continue
 
+            siz = len(encoded)
             if siz > 200000:
                 raise Exception("Size too big")
 
-            buf = struct.pack('<H I', typ, siz)
-            typ, siz = struct.unpack('<H I', buf)
-
-            if encoded is not None:
-                buf += struct.pack('<%ds'%siz, encoded)
-
-            string += buf
+            pieces.append(pack(typ, siz))
+            pieces.append(encoded)
             continue
-        return string
+        return ''.join(pieces)
 
     pass
 
@@ -138,9 +296,9 @@ Notes:
         (0x0, ('ignored', NullCoder(), None)),
         (0x1, ('groupid', IntCoder(), lambda: randrange(1, 2**(4*8)-1))),
         (0x2, ('group_name', StringCoder(), lambda: "Unknown")),
-        (0x3, ('creation_time', DatetimeCoder(), datetime.now)),
-        (0x4, ('lastmod_time', DatetimeCoder(), datetime.now)),
-        (0x5, ('lastacc_time', DatetimeCoder(), datetime.now)),
+        (0x3, ('creation_time', DatetimeCoder(), current_time)),
+        (0x4, ('lastmod_time', DatetimeCoder(), current_time)),
+        (0x5, ('lastacc_time', DatetimeCoder(), current_time)),
         (0x6, ('expire_time', DatetimeCoder(), lambda: datetime(2999, 12, 28, 23, 59))),
         (0x7, ('imageid', IntCoder(), lambda: 0)),
         (0x8, ('level', ShortCoder(), lambda: 0)),
@@ -148,8 +306,12 @@ Notes:
         (0xFFFF, (None, None, None)),
         ])
 
-    def __init__(self,string=None):
-        super(GroupInfo, self).__init__(GroupInfo.format, string)
+    __slots__ = slots(format)
+    _ranks = ranks(format)
+    _codecs = codecs(format)
+
+    def __init__(self,string=None,offset=0,**fields):
+        super(GroupInfo, self).__init__(string, offset, **fields)
         return
 
     def name(self):
@@ -199,17 +361,21 @@ Notes:
         (0x6, ('username', StringCoder(), lambda: "")),
         (0x7, ('password', StringCoder(), lambda: "")),
         (0x8, ('notes', StringCoder(), lambda: "")),
-        (0x9, ('creation_time', DatetimeCoder(), datetime.now)),
-        (0xa, ('last_mod_time', DatetimeCoder(), datetime.now)),
-        (0xb, ('last_acc_time', DatetimeCoder(), datetime.now)),
+        (0x9, ('creation_time', DatetimeCoder(), current_time)),
+        (0xa, ('last_mod_time', DatetimeCoder(), current_time)),
+        (0xb, ('last_acc_time', DatetimeCoder(), current_time)),
         (0xc, ('expiration_time', DatetimeCoder(), lambda: datetime(2999, 12, 28, 0, 0))),
         (0xd, ('binary_desc', StringCoder(), lambda: "")),
         (0xe, ('binary_data', ShuntCoder(), lambda: "")),
         (0xFFFF, (None, None, None)),
     ])
 
-    def __init__(self,string=None):
-        super(EntryInfo, self).__init__(EntryInfo.format, string)
+    __slots__ = slots(format)
+    _ranks = ranks(format)
+    _codecs = codecs(format)
+
+    def __init__(self,string=None,offset=0,**fields):
+        super(EntryInfo, self).__init__(string, offset, **fields)
         return
 
     def name(self):
@@ -218,3 +384,115 @@ Notes:
 
     pass
 
+
+
+def make_entries(items, now=None, uuids=None):
+    '''Return a list of new EntryInfo objects, one for each mapping of
+    field names to values in items.  Creation, modification and access
+    times not given are all set to now, by default the current time.
+    UUIDs not given are drawn together, from the alloc.UuidAllocator
+    uuids if given.'''
+    from alloc import UuidAllocator
+
+    items = [dict(item) for item in items]
+    if now is None:
+        now = current_time()
+    if uuids is None:
+        uuids = UuidAllocator()
+    fresh = uuids.reserve(sum(1 for item in items if 'uuid' not in item))
+    fresh.reverse()
+
+    ret = []
+    for item in items:
+        if 'uuid' not in item:
+            item['uuid'] = fresh.pop()
+        for name in ('creation_time', 'last_mod_time', 'last_acc_time'):
+            item.setdefault(name, now)
+            continue
+        ret.append(EntryInfo(**item))
+        continue
+    return ret
+
+
+class LazyEntryInfo(EntryInfo):
+    '''
+    An EntryInfo which only records where it starts in the payload
+    and decodes each field on first access, finding it by scanning
+    the field headers.  Decoded values are kept, so each field is
+    decoded at most once.  All the entries read from a payload share
+    it, and each holds it until materialize() is called.
+    '''
+
+    __slots__ = ('_data', '_start')
+
+    # field name -> type
+    _types_of = dict((item[0], typ) for typ, item in EntryInfo.format.iteritems()
+                     if item[0] is not None)
+
+    def __init__(self, string, offset=0):
+        set_field = object.__setattr__
+        set_field(self, '_listeners', ())
+        set_field(self, '_data', string)
+        set_field(self, '_start', offset)
+        ranks = self._ranks
+        unpack_from = FIELD_HEADER.unpack_from
+        canonical = True
+        last = -1
+        extra = None
+        index = offset
+        while True:
+            typ, siz = unpack_from(string, index)
+            index += 6
+            rank = ranks.get(typ, -1)
+            if rank < 0:
+                if extra is None: extra = {}
+                buf = string[index:index+siz]
+                if not isinstance(buf, str):
+                    buf = buf.tobytes()
+                extra[typ] = buf
+            if canonical:
+                canonical = rank > last
+                last = rank
+            if typ == 0xFFFF: break
+            index += siz
+            continue
+        set_field(self, '_length', index + siz - offset)
+        types = None
+        if not canonical:
+            types = tuple(typ for typ, siz, index in walk(string, offset))
+        set_field(self, '_order', types)
+        set_field(self, '_extra', extra)
+        return
+
+    def __getattr__(self, name):
+        'Called only for fields not yet decoded'
+        want = self._types_of.get(name)
+        if want is None or self._data is None:
+            raise AttributeError, name
+        data = self._data
+        unpack_from = FIELD_HEADER.unpack_from
+        index = self._start
+        while True:
+            typ, siz = unpack_from(data, index)
+            index += 6
+            if typ == want: break
+            if typ == 0xFFFF:
+                raise AttributeError, name
+            index += siz
+            continue
+        buf = data[index:index+siz]
+        if not isinstance(buf, str):
+            buf = buf.tobytes()
+        value = self._codecs[typ][1](buf)
+        object.__setattr__(self, name, value)
+        return value
+
+    def materialize(self):
+        'Decode all remaining fields and release the payload'
+        for name in self._types_of:
+            getattr(self, name, None)
+            continue
+        object.__setattr__(self, '_data', None)
+        return
+
+    pass
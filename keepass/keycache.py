@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+'''
+A cache of transformed master keys.
+
+Stretching the composite key with Database.transform() is by design
+the most expensive part of opening a file.  When the same credentials
+are used to open the same file over and over in one process the
+result of that stretch does not change, so it may be kept in memory
+and reused.
+
+Entries are keyed on a digest of the composite key (the composite key
+itself is never held by the cache), the transform seed and the number
+of rounds.  The cache holds at most a fixed number of keys, evicting
+the least recently used one, and each key expires after a given
+number of seconds.
+
+Usage:
+
+    from keepass import kpdb, keycache
+    kpdb.Database.keycache = keycache.KeyCache(maxsize=8, ttl=300)
+'''
+
+import time, hashlib, threading
+from collections import OrderedDict
+
+class KeyCache(object):
+    '''
+    A bounded, LRU-evicting, expiring map from (composite key digest,
+    transform seed, rounds) to the transformed master key.
+    '''
+
+    def __init__(self, maxsize=16, ttl=300, clock=time.time):
+        '''Hold at most maxsize keys for ttl seconds each.  A ttl of
+        None means keys never expire.'''
+        if maxsize < 1:
+            raise ValueError, 'KeyCache maxsize must be positive, got %s'%maxsize
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+        return
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __str__(self):
+        return 'KeyCache: %d/%d keys, %d hits, %d misses'%\
+            (len(self), self.maxsize, self.hits, self.misses)
+
+    def make_key(self, composite_key, seed, rounds):
+        'Return the cache key for the given transform inputs'
+        return (hashlib.sha256(composite_key).digest(), seed, rounds)
+
+    def get(self, composite_key, seed, rounds):
+        'Return the cached transformed key or None'
+        key = self.make_key(composite_key, seed, rounds)
+        with self._lock:
+            try:
+                tkey, expires = self._keys.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            if expires is not None and expires <= self.clock():
+                self.misses += 1
+                return None
+            self._keys[key] = (tkey, expires) # mark most recently used
+            self.hits += 1
+        return tkey
+
+    def put(self, composite_key, seed, rounds, tkey):
+        'Store a transformed key, evicting the oldest if full'
+        key = self.make_key(composite_key, seed, rounds)
+        expires = None
+        if self.ttl is not None:
+            expires = self.clock() + self.ttl
+        with self._lock:
+            self._keys.pop(key, None)
+            self._keys[key] = (tkey, expires)
+            while len(self._keys) > self.maxsize:
+                self._keys.popitem(last=False)
+                continue
+        return
+
+    def purge(self, seed=None):
+        '''Forget cached keys.  If a transform seed is given only keys
+        derived with it are dropped.  Return the number dropped.'''
+        with self._lock:
+            if seed is None:
+                count = len(self._keys)
+                self._keys.clear()
+                return count
+            doomed = [key for key in self._keys if key[1] == seed]
+            for key in doomed:
+                del self._keys[key]
+                continue
+        return len(doomed)
+
+    def expire(self):
+        'Drop all keys which have outlived the ttl, return the number dropped'
+        now = self.clock()
+        with self._lock:
+            doomed = [key for key,(tkey,expires) in self._keys.iteritems()
+                      if expires is not None and expires <= now]
+            for key in doomed:
+                del self._keys[key]
+                continue
+        return len(doomed)
+
+    def stats(self):
+        'Return a dictionary of cache statistics'
+        return dict(hits=self.hits, misses=self.misses,
+                    size=len(self), maxsize=self.maxsize, ttl=self.ttl)
+
+    pass
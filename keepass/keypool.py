@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+'''
+A background supply of fresh transform seeds and their transformed keys.
+
+Writing a file with regenerated seeds (see Database.regenerate())
+needs the composite key transformed under the new transform seed,
+which costs as much as opening the file.  A KeyPool does that work
+ahead of time in a background thread so a later write can pick up a
+ready (seed, transformed key) pair without waiting.
+
+Usage:
+
+    pool = KeyPool(db.composite_key(), db.header.transform_rounds)
+    ...
+    pair = pool.take(db.composite_key(), db.header.transform_rounds)
+    if pair is None:
+        # nothing ready (yet), derive synchronously
+'''
+
+import os, hashlib, threading
+from transform import TransformEngine, TransformCancelled
+
+class KeyPool(object):
+    '''
+    Keep up to size (seed, transformed key) pairs derived in a
+    background thread for one composite key and number of rounds.
+    '''
+
+    def __init__(self, composite_key, rounds, size=1, engine_class=TransformEngine):
+        self.size = size
+        self.engine_class = engine_class
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._ready = []
+        self._target = None
+        self._thread = None
+        self.reset(composite_key, rounds)
+        return
+
+    def _digest(self, composite_key):
+        return hashlib.sha256(composite_key).digest()
+
+    def reset(self, composite_key, rounds):
+        'Drop any ready pairs and start deriving for the given key and rounds'
+        with self._cond:
+            self._ready = []
+            self._target = (composite_key, rounds)
+            self._cond.notify()
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+        return
+
+    def ready(self):
+        'Return the number of pairs ready to be taken'
+        return len(self._ready)
+
+    def take(self, composite_key, rounds):
+        '''Return a ready (seed, transformed key) pair for the given
+        composite key and rounds, or None if there is none.  A
+        mismatch retargets the pool to the given key and rounds.'''
+        with self._cond:
+            target = self._target
+            if target is None or target[1] != rounds or \
+                    self._digest(target[0]) != self._digest(composite_key):
+                pass
+            elif self._ready:
+                pair = self._ready.pop(0)
+                self._cond.notify()
+                return pair
+            else:
+                return None
+        self.reset(composite_key, rounds)
+        return None
+
+    def stop(self):
+        'Stop the background thread, abandoning any derivation in progress'
+        self._stop.set()
+        with self._cond:
+            self._ready = []
+            self._target = None
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        return
+
+    def _run(self):
+        engine = self.engine_class(cancel=self._stop)
+        while not self._stop.is_set():
+            with self._cond:
+                while not self._stop.is_set() and \
+                        (self._target is None or len(self._ready) >= self.size):
+                    self._cond.wait()
+                    continue
+                target = self._target
+            if self._stop.is_set(): break
+
+            composite_key, rounds = target
+            seed = os.urandom(32)
+            try:
+                tkey = engine(composite_key, seed, rounds)
+            except TransformCancelled:
+                break
+            with self._cond:
+                if self._target is target:
+                    self._ready.append((seed, tkey))
+            continue
+        return
+
+    pass
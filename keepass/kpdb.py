@@ -12,26 +12,85 @@ General structure:
 
 '''
 
-import sys, struct, hashlib
+import os, sys, struct, hashlib
 
 from header import DBHDR
-from infoblock import GroupInfo, EntryInfo
+from infoblock import GroupInfo, EntryInfo, LazyEntryInfo
+from transform import TransformEngine, calibrate
 from Crypto.Cipher import AES
-from random import randrange
 
 class Database(object):
     '''
     Access a KeePass DB file of format v3
     '''
+
+    # Process-wide keycache.KeyCache of transformed master keys, if
+    # any.  A cache given to the constructor takes precedence.
+    keycache = None
+
+    # Callable doing the key transformation, see transform.py
+    engine = TransformEngine()
+
+    # keypool.KeyPool of pre-derived keys for regenerate(), if any
+    keypool = None
+
+    # columnar.EntryColumns holding the entries in columnar mode
+    columns = None
+
+    # (composite key digest, seed, rounds, transformed key) last used
+    _transformed = None
+
+    # Indexes of entry and group fields, each field indexed once it is
+    # looked up, see entry_index()
+    _entry_index = None
+    _group_index = None
+    _groupids = None
+    _uuids = None
+
+    # hier.Tree of the groups and entries once in use, see tree()
+    _tree = None
+
+    # search.SearchIndex of the entries once in use, see search_index()
+    _search = None
+
+    # urlindex.UrlIndex of the entries once in use, see url_index()
+    _urls = None
     
-    def __init__(self, filename = None, masterkey=None, filekey=None, passphrase=None):
+    def __init__(self, filename = None, masterkey=None, filekey=None, passphrase=None,
+                 keycache=None, engine=None, lazy=False, use_mmap=False,
+                 prederive=False, columnar=False, index_search=False):
+        '''If lazy is True, entry fields are only decoded when first
+        accessed, see infoblock.LazyEntryInfo.  If use_mmap is True
+        the file is memory mapped instead of read, see read_mmap().
+        If prederive is True, keys for regenerated seeds are derived in
+        the background once the file is read, see start_keypool().
+        If columnar is True, entries are read into self.columns
+        instead of self.entries, see columnar.EntryColumns.  The
+        columns may be read and the database written, but all that
+        works on entries (get(), find(), search(), match_url(),
+        resolve(), glob(), group_entries(), dump_entries(), the tree
+        and the indexes, and so adding or removing entries and groups
+        through them) raises ValueError until columns_to_entries().  If
+        index_search is True the full text search index is built once
+        the file is read, rather than on the first search().'''
         self.masterkey = masterkey
         self.filekey = filekey
         self.passphrase = passphrase
+        self.lazy = lazy
+        self.use_mmap = use_mmap
+        self.columnar = columnar
+        if keycache is not None:
+            self.keycache = keycache
+        if engine is not None:
+            self.engine = engine
 
         self.filename = filename
         if filename:
             self.read(filename)
+            if prederive:
+                self.start_keypool()
+            if index_search:
+                self.search_index()
             return
         self.header = DBHDR()
         self.groups = []
@@ -40,14 +99,24 @@ class Database(object):
 
     def read(self,filename):
         'Read in given .kdb file'
-        fp = open(filename)
+        if self.use_mmap:
+            return self.read_mmap(filename)
+
+        payload = self.decrypt_file(filename)
+        self.groups = []
+        self.entries = []
+        self.parse_payload(payload)
+        return
+
+    def decrypt_file(self, filename):
+        '''Read the header of the given .kdb file and return its
+        payload decrypted but not parsed'''
+        fp = open(filename,'rb')
         buf = fp.read()
         fp.close()
 
         headbuf = buf[:124]
         self.header = DBHDR(headbuf)
-        self.groups = []
-        self.entries = []
 
         payload = buf[124:]
 
@@ -61,41 +130,424 @@ class Database(object):
 #                                       self.header.transform_seed,
 #                                       self.header.transform_rounds)
         self.finalkey = self.final_key()
-        payload = self.decrypt_payload(payload, self.finalkey, 
-                                       self.header.encryption_type(),
-                                       self.header.encryption_iv)
+        return self.decrypt_payload(payload, self.finalkey, 
+                                    self.header.encryption_type(),
+                                    self.header.encryption_iv)
+
+    def load(self, header, payload, transformed=None):
+        '''Fill the database from a header and payload decrypted
+        elsewhere, see open_many().  If given, transformed is the
+        (composite key digest, seed, rounds, transformed key) used to
+        decrypt, kept as transformed_key() would so that writing with
+        the same seeds does not transform the key again.'''
+        self.header = DBHDR(header)
+        self.groups = []
+        self.entries = []
+        if transformed is not None:
+            self._transformed = transformed
+            if self.keycache is not None:
+                self.keycache.put(self.composite_key(), *transformed[1:])
+        self.parse_payload(payload)
+        return
+
+    def read_mmap(self, filename, chunksize=1<<20):
+        '''
+        Read in given .kdb file through a read-only memory map.
 
-        ngroups = self.header.ngroups
-        while ngroups:
-            gi = GroupInfo(payload)
+        The header is decoded in place and the ciphertext is handed to
+        the cipher as a view of the map so the file contents are never
+        copied.  Where the cipher only accepts strings, it is copied a
+        chunk at a time instead.
+        '''
+        import mmap
+
+        fp = open(filename,'rb')
+        try:
+            mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            fp.close()
+
+        try:
+            self.header = DBHDR(mm)
+            self.groups = []
+            self.entries = []
+
+            enctype = self.header.encryption_type()
+            if enctype != 'Rijndael':
+                raise ValueError, 'Unsupported decryption type: "%s"'%enctype
+
+            self.finalkey = self.final_key()
+            cipher = AES.new(self.finalkey, AES.MODE_CBC, self.header.encryption_iv)
+            try:
+                payload = cipher.decrypt(mapview(mm, DBHDR.length))
+            except TypeError:
+                chunksize -= chunksize % AES.block_size
+                payload = ''.join([cipher.decrypt(mm[start:start+chunksize])
+                                   for start in xrange(DBHDR.length, len(mm), chunksize)])
+        finally:
+            mm.close()
+
+        payload = self.unpad_payload(payload)
+        self.check_payload(payload)
+        self.parse_payload(payload)
+        return
+
+    def parse_payload(self, payload):
+        'Fill the groups and entries from the decrypted payload'
+        view = memoryview(payload)
+        offset = 0
+        for count in xrange(self.header.ngroups):
+            gi = GroupInfo(view, offset)
             self.groups.append(gi)
-            length = len(gi)
-            #print 'GroupInfo of length',length,'payload=',len(payload)
-            payload = payload[length:]
-            ngroups -= 1
+            offset += len(gi)
             continue
 
-        nentries = self.header.nentries
-        while nentries:
-            ei = EntryInfo(payload)
+        if self.columnar:
+            from columnar import EntryColumns
+            self.columns = EntryColumns()
+            for count in xrange(self.header.nentries):
+                offset = self.columns.append_record(view, offset)
+                continue
+            return
+
+        entry_class = EntryInfo
+        if self.lazy:
+            # the entries slice their fields out of the string itself
+            entry_class = LazyEntryInfo
+            view = payload
+        for count in xrange(self.header.nentries):
+            ei = entry_class(view, offset)
             self.entries.append(ei)
-            payload = payload[len(ei):]
-            nentries -= 1
+            offset += len(ei)
+            continue
+        return
+
+    def _check_entries(self):
+        'Raise ValueError while the entries are held in self.columns'
+        if self.columns is not None:
+            raise ValueError, 'entries are held in columns, see columns_to_entries()'
+        return
+
+    def columns_to_entries(self):
+        '''Replace the columnar entries with EntryInfo objects
+        appended to self.entries'''
+        if self.columns is None: return
+        self.entries.extend(self.columns.to_entries())
+        self.columns = None
+        return
+
+    def nentries(self):
+        'Return the number of entries, in whichever form they are held'
+        count = len(self.entries)
+        if self.columns is not None:
+            count += len(self.columns)
+        return count
+
+    def iter_records(self, filename=None, chunksize=65536):
+        '''
+        Generate the GroupInfo and then the EntryInfo records of the
+        given .kdb file as soon as each is decrypted.
+
+        The file is read, decrypted and hashed chunksize bytes at a
+        time so only about one chunk and one record are held in
+        memory.  The header is kept as self.header but the records
+        are not collected.  ValueError is raised once the file is
+        exhausted if its checksum does not match.
+        '''
+        from infoblock import record_end
+
+        chunksize -= chunksize % AES.block_size
+        if chunksize <= 0:
+            raise ValueError, 'Chunk size must be at least %d'%AES.block_size
+
+        fp = open(filename or self.filename,'rb')
+        try:
+            self.header = DBHDR(fp.read(DBHDR.length))
+            enctype = self.header.encryption_type()
+            if enctype != 'Rijndael':
+                raise ValueError, 'Unsupported decryption type: "%s"'%enctype
+            self.finalkey = self.final_key()
+            cipher = AES.new(self.finalkey, AES.MODE_CBC, self.header.encryption_iv)
+            contents_hash = hashlib.sha256()
+
+            entry_class = EntryInfo
+            if self.lazy:
+                entry_class = LazyEntryInfo
+            classes = [GroupInfo]*self.header.ngroups + \
+                [entry_class]*self.header.nentries
+            classes.reverse()
+
+            pending = bytearray()
+            held = ''           # last block, may hold padding
+            while True:
+                chunk = fp.read(chunksize)
+                if chunk:
+                    if len(chunk) % AES.block_size:
+                        raise ValueError, "Decryption failed.\nThe file is truncated"
+                    plain = held + cipher.decrypt(chunk)
+                    held = plain[-AES.block_size:]
+                    plain = plain[:-AES.block_size]
+                else:
+                    extra = held and ord(held[-1])
+                    if not held or not 0 < extra <= AES.block_size:
+                        raise ValueError, "Decryption failed.\nThe key is wrong or the file is damaged"
+                    plain = held[:len(held)-extra]
+                contents_hash.update(plain)
+                pending.extend(plain)
+
+                offset = 0
+                while classes:
+                    end = record_end(pending, offset)
+                    if end is None: break
+                    try:
+                        record = classes[-1](str(pending[offset:end]))
+                    except (KeyError, struct.error):
+                        raise ValueError, "Decryption failed.\nThe key is wrong or the file is damaged"
+                    classes.pop()
+                    offset = end
+                    yield record
+                    continue
+                del pending[:offset]
+
+                if not chunk: break
+                continue
+        finally:
+            fp.close()
+
+        if classes or self.header.contents_hash != contents_hash.digest():
+            raise ValueError, "Decryption failed. The file checksum did not match."
+        return
+
+    def iter_entries(self, filename=None, chunksize=65536):
+        'Generate only the EntryInfo records, see iter_records()'
+        for record in self.iter_records(filename, chunksize):
+            if isinstance(record, EntryInfo):
+                yield record
             continue
         return
 
+    def _live(self, attr, *records):
+        '''Return the structure kept in attr if it is in use and still
+        describes the given lists of records, else None'''
+        view = getattr(self, attr)
+        if view is None or not view.current(*records):
+            return None
+        return view
+
+    def _current_index(self, attr, factory, *records):
+        '''Return the structure kept in attr over the given lists of
+        records, building it with factory(*records) if there is none or
+        the lists were replaced or changed behind its back.  Once built,
+        the methods adding, moving and removing records keep it in
+        step.'''
+        view = self._live(attr, *records)
+        if view is None:
+            old = getattr(self, attr)
+            if old is not None:
+                old.detach()
+            view = factory(*records)
+            setattr(self, attr, view)
+        return view
+
+    def entry_index(self):
+        'Return the index.Index over the entries, see _current_index()'
+        from index import Index
+        self._check_entries()
+        return self._current_index('_entry_index', Index, self.entries)
+
+    def group_index(self):
+        'Return the index.Index over the groups, see _current_index()'
+        from index import Index
+        return self._current_index('_group_index', Index, self.groups)
+
+    def find(self, **fields):
+        '''Return a list of all entries matching the given field values,
+        eg. db.find(title="Mail", username="me")'''
+        return self.entry_index().find(**fields)
+
     def get(self, title=None):
-        for e in self.entries:
-            if e.title == title:
-                return e
+        'Return the first entry with the given title or None'
+        found = self.entry_index().lookup('title', title)
+        if found: return found[0]
+        return None
+
+    def tree(self):
+        'Return the hier.Tree of the groups and entries, see _current_index()'
+        from hier import Tree
+        self._check_entries()
+        return self._current_index('_tree', Tree, self.groups, self.entries)
+
+    def _live_tree(self):
+        'Return the tree if it is in use and current, else None'
+        return self._live('_tree', self.groups, self.entries)
+
+    def search_index(self):
+        'Return the search.SearchIndex of the entries, see _current_index()'
+        from search import SearchIndex
+        self._check_entries()
+        return self._current_index('_search', SearchIndex, self.entries)
+
+    def search(self, query, limit=None):
+        '''Return the entries matching all words of the query, best
+        match first, at most limit of them.  A word ending in '*'
+        matches as a prefix.  See search.SearchIndex.'''
+        return [entry for score, entry in self.search_index().search(query, limit)]
+
+    def url_index(self):
+        'Return the urlindex.UrlIndex of the entries, see _current_index()'
+        from urlindex import UrlIndex
+        self._check_entries()
+        return self._current_index('_urls', UrlIndex, self.entries)
+
+    def match_url(self, url, limit=None):
+        '''Return the entries for the host of the given URL or its
+        parent domains, best match first, at most limit of them.  See
+        urlindex.UrlIndex.match().'''
+        return self.url_index().match(url, limit)
+
+    def _entry_views(self):
+        'Return the structures over the entries to keep in step with them'
+        views = (self._live_tree(), self._live('_search', self.entries),
+                 self._live('_urls', self.entries))
+        return [view for view in views if view is not None]
+
+    def _order_groups(self):
+        'Put the groups in the order, and with the levels, of the tree'
+        tree = self._live_tree()
+        if tree is None or tree.ordered: return
+        self.group_index().reorder(tree.order())
+        tree.ordered = True
+        return
+
+    def append_entry(self, entry):
+        'Add an entry to the end of the entries'
+        views = self._entry_views()
+        self.entry_index().insert(entry)
+        for view in views:
+            view.add_entry(entry)
+            continue
+        return
+
+    def remove_entry(self, entry):
+        '''Remove an entry.  The last entry takes the place of the
+        removed one, see index.Index.remove().'''
+        views = self._entry_views()
+        self.entry_index().remove(entry)
+        for view in views:
+            view.remove_entry(entry)
+            continue
+        return
+
+    def append_group(self, group, parent=None):
+        '''Add a group.  Once the tree is in use, or if a parent group
+        is given, the group becomes the last child of parent, or a top
+        level group if parent is None.  Otherwise it is added to the end
+        of the groups, whose order and levels define the hierarchy.'''
+        tree = self._live_tree()
+        if tree is None and parent is not None:
+            tree = self.tree()
+        self.group_index().insert(group)
+        if tree is not None:
+            tree.add_group(group, parent)
+        return
+
+    def remove_group(self, group):
+        '''Remove a group together with the groups below it and the
+        entries of all of them.'''
+        tree = self.tree()
+        views = [view for view in self._entry_views() if view is not tree]
+        groups, entries = tree.remove_group(group)
+        self.group_index().remove_all(groups)
+        entry_index = self.entry_index()
+        for entry in entries:
+            entry_index.remove(entry)
+            for view in views:
+                view.remove_entry(entry)
+                continue
+            continue
+        return
+
+    def move_group(self, group, parent=None):
+        '''Move a group, with all below it, to be the last child of the
+        parent group, or a top level group if parent is None'''
+        self.tree().move_group(group, parent)
+        return
+
+    def mkdir(self, path):
+        '''Return the group at the given path, a list of group names or
+        a '/' separated string, adding the groups missing along it.
+        Return None for the empty path.'''
+        import hier, infoblock
+        tree = self.tree()
+        node = tree.top
+        for name in hier.path2list(path):
+            if not name: continue
+            child = node.child(name)
+            if child is None:
+                group = infoblock.GroupInfo(
+                    groupid=self.gen_groupid(), group_name=name, imageid=1)
+                self.append_group(group, node.group)
+                child = tree.node(group)
+            node = child
+            continue
+        return node.group
+
+    def group_entries(self, groupid):
+        'Return a list of the entries in the group with the given ID'
+        return self.entry_index().lookup('groupid', groupid)
+
+    def entry_group(self, entry):
+        'Return the group holding the given entry or None'
+        return self.group('groupid', entry.groupid)
 
     def transform(self, key, seed, rounds):
-        cipher = AES.new(seed,  AES.MODE_ECB)
-        total = 0
-        for i in range(0, rounds):
-            total += 1
-            key = cipher.encrypt(key)
-        return key
+        'Encrypt key with seed for the given number of rounds'
+        return self.engine(key, seed, rounds)
+
+    def calibrate_rounds(self, target=1.0):
+        'Return the number of transform rounds taking target seconds here'
+        return calibrate(target, self.engine)
+
+    def regenerate(self, rounds=None):
+        '''Replace the master seeds and encryption IV in the header with
+        fresh random values and optionally set the number of transform
+        rounds.  The final key is derived anew on the next write(),
+        unless the keypool already has one ready.'''
+        if rounds is not None:
+            self.header.transform_rounds = rounds
+        self.header.final_master_seed = os.urandom(16)
+        self.header.encryption_iv = os.urandom(16)
+        self.header.transform_seed = os.urandom(32)
+        if self.keypool is None:
+            return
+
+        composite_key = self.composite_key()
+        pair = self.keypool.take(composite_key, self.header.transform_rounds)
+        if pair is None:
+            return
+        seed, tmaster = pair
+        rounds = self.header.transform_rounds
+        self.header.transform_seed = seed
+        self._transformed = (hashlib.sha256(composite_key).digest(),
+                             seed, rounds, tmaster)
+        if self.keycache is not None:
+            self.keycache.put(composite_key, seed, rounds, tmaster)
+        return
+
+    def start_keypool(self, size=1):
+        '''Start deriving keys for fresh transform seeds in the
+        background so regenerate() need not wait for them.'''
+        from keypool import KeyPool
+        self.stop_keypool()
+        self.keypool = KeyPool(self.composite_key(), self.header.transform_rounds, size)
+        return
+
+    def stop_keypool(self):
+        'Stop any background key derivation'
+        if self.keypool is not None:
+            self.keypool.stop()
+            self.keypool = None
+        return
 
     def composite_key(self):
         if self.filekey and not self.passphrase:
@@ -109,9 +561,27 @@ class Database(object):
         composite.update(self.filekey)
         return composite.digest()
 
-    def final_key(self):
+    def transformed_key(self):
+        'Return the composite key transformed per the header, maybe from the cache'
         composite_key = self.composite_key()
-        tmaster = self.transform(composite_key, self.header.transform_seed, self.header.transform_rounds)
+        seed = self.header.transform_seed
+        rounds = self.header.transform_rounds
+        digest = hashlib.sha256(composite_key).digest()
+        if self._transformed and self._transformed[:3] == (digest, seed, rounds):
+            return self._transformed[3]
+
+        tmaster = None
+        if self.keycache is not None:
+            tmaster = self.keycache.get(composite_key, seed, rounds)
+        if tmaster is None:
+            tmaster = self.transform(composite_key, seed, rounds)
+            if self.keycache is not None:
+                self.keycache.put(composite_key, seed, rounds, tmaster)
+        self._transformed = (digest, seed, rounds, tmaster)
+        return tmaster
+
+    def final_key(self):
+        tmaster = self.transformed_key()
         tdigest = hashlib.sha256(tmaster).digest()
         return hashlib.sha256(self.header.final_master_seed + tdigest).digest()
 
@@ -141,6 +611,11 @@ class Database(object):
             raise ValueError, 'Unsupported decryption type: "%s"'%enctype
 
         payload = self.decrypt_payload_aes_cbc(payload, finalkey, iv)
+        self.check_payload(payload)
+        return payload
+
+    def check_payload(self, payload):
+        'Raise ValueError unless payload is the decrypted, unpadded contents'
         crypto_size = len(payload)
 
         if ((crypto_size > 2147483446) or (not crypto_size and self.header.ngroups)):
@@ -153,7 +628,7 @@ class Database(object):
         if self.header.contents_hash != hashlib.sha256(payload).digest():
             raise ValueError, "Decryption failed. The file checksum did not match."
 
-        return payload
+        return
 
     def decrypt_payload_aes_cbc(self, payload, finalkey, iv):
         'Decrypt payload buffer with AES CBC'
@@ -161,6 +636,10 @@ class Database(object):
         from Crypto.Cipher import AES
         cipher = AES.new(finalkey, AES.MODE_CBC, iv)
         payload = cipher.decrypt(payload)
+        return self.unpad_payload(payload)
+
+    def unpad_payload(self, payload):
+        'Strip the padding from a decrypted payload'
         extra = ord(payload[-1])
         payload = payload[:len(payload)-extra]
         #print 'Unpadding payload by',extra
@@ -176,150 +655,298 @@ class Database(object):
         'Encrypt payload buffer with AES CBC'
         from Crypto.Cipher import AES
         cipher = AES.new(finalkey, AES.MODE_CBC, iv)
-        # pad out and store amount as last value
-        length = len(payload)
-        encsize = (length/AES.block_size+1)*16
-        padding = encsize - length
+        return cipher.encrypt(self.pad_payload(payload))
+
+    def pad_payload(self, payload):
+        'Pad out payload to whole blocks, storing the amount as last value'
+        padding = AES.block_size - len(payload) % AES.block_size
         #print 'Padding payload by',padding
-        for ind in range(padding):
-            payload += chr(padding)
-        return cipher.encrypt(payload)
+        return payload + chr(padding)*padding
         
     def __str__(self):
         ret = [str(repr(self.header))]
         ret += map(str,self.groups)
         ret += map(str,self.entries)
+        if self.columns is not None:
+            ret += map(str,self.columns)
         return '\n'.join(ret)
 
-    def encode_payload(self):
-        'Return encoded, plaintext groups+entries buffer'
-        payload = ""
+    def iter_payload(self):
+        'Generate the encoded, plaintext groups and then entries'
+        self._order_groups()
         for group in self.groups:
-            payload += group.encode()
+            yield group.encode()
         for entry in self.entries:
-            payload += entry.encode()
-        return payload
+            yield entry.encode()
+        if self.columns is not None:
+            for row in xrange(len(self.columns)):
+                yield self.columns.encode_row(row)
+                continue
+        return
+
+    def encode_payload(self):
+        'Return encoded, plaintext groups+entries buffer'
+        return ''.join(self.iter_payload())
 
-    def write(self, filename=None):
+    def write(self, filename=None, regenerate=False, rounds=None, chunksize=65536):
         '''' 
         Write out DB to given filename with optional master key.
         If no master key is given, the one used to create this DB is used.
+
+        If regenerate is True, fresh seeds and IV are used.  If rounds
+        is given the number of transform rounds is changed to it, see
+        calibrate_rounds().
+
+        Records are encoded, hashed, encrypted and written about
+        chunksize bytes at a time.  The header is written last, once
+        the contents hash is known.  All this goes to a temporary file
+        next to the target, which replaces the target only once it is
+        complete and synced, so a failure leaves the old file intact.
         '''
-        import hashlib
+        import hashlib, tempfile
 
         outfilename = filename or self.filename
+        if regenerate:
+            self.regenerate(rounds)
+        elif rounds is not None:
+            self.header.transform_rounds = rounds
         self.header.ngroups = len(self.groups)
-        self.header.nentries = len(self.entries)
+        self.header.nentries = self.nentries()
 
         header = DBHDR(self.header.encode())
 
-        # fixme: should regenerate encryption_iv, master_seed,
-        # master_seed2 and allow for the number of rounds to change
-
-        payload = self.encode_payload()
-        header.contents_hash = hashlib.sha256(payload).digest()
-
-#        finalkey = self.final_key(masterkey = masterkey or self.masterkey,
-#                                  masterseed = self.header.master_seed,
-#                                  masterseed2 = self.header.master_seed2,
-#                                  rounds = self.header.key_enc_rounds)
-
-        payload = self.encrypt_payload(payload, self.final_key(), 
-                                       header.encryption_type(),
-                                       header.encryption_iv)
-
-        fp = open(outfilename,'w')
-        fp.write(header.encode())
-        fp.write(payload)
-        fp.close()
+        enctype = header.encryption_type()
+        if enctype != 'Rijndael':
+            raise ValueError, 'Unsupported encryption type: "%s"'%enctype
+        self.finalkey = self.final_key()
+        cipher = AES.new(self.finalkey, AES.MODE_CBC, header.encryption_iv)
+        contents_hash = hashlib.sha256()
+
+        outdir, outbase = os.path.split(os.path.abspath(outfilename))
+        fd, tmpfilename = tempfile.mkstemp(prefix='.'+outbase, suffix='.tmp', dir=outdir)
+        fp = os.fdopen(fd,'wb')
+        try:
+            fp.seek(DBHDR.length)
+            pending = []
+            size = 0
+            for buf in self.iter_payload():
+                contents_hash.update(buf)
+                pending.append(buf)
+                size += len(buf)
+                if size < chunksize: continue
+
+                buf = ''.join(pending)
+                keep = size % AES.block_size
+                fp.write(cipher.encrypt(buf[:size-keep]))
+                pending = [buf[size-keep:]]
+                size = keep
+                continue
+            fp.write(cipher.encrypt(self.pad_payload(''.join(pending))))
+
+            header.contents_hash = contents_hash.digest()
+            fp.seek(0)
+            fp.write(header.encode())
+            fp.flush()
+            os.fsync(fp.fileno())
+            fp.close()
+            if os.path.exists(outfilename):
+                os.chmod(tmpfilename, os.stat(outfilename).st_mode & 07777)
+            os.rename(tmpfilename, outfilename)
+        except:
+            fp.close()
+            os.remove(tmpfilename)
+            raise
+        self.header.contents_hash = header.contents_hash
         return
 
     def group(self,field,value):
         'Return the group which has the given field and value'
-        for group in self.groups:
-            if group.__dict__[field] == value: return group
-            continue
+        found = self.group_index().lookup(field, value)
+        if found: return found[0]
         return None
 
     def dump_entries(self,format,show_passwords=False):
+        self._check_entries()
+        self._order_groups()
         for ent in self.entries:
             group = self.group('groupid',ent.groupid)
             if not group:
                 sys.stderr.write("Skipping missing group with ID %d\n"%
                                  ent.groupid)
                 continue
-            dat = dict(ent.__dict__) # copy
+            dat = ent.asdict()
             if not show_passwords:
                 dat['password'] = '****'
             for what in ['group_name','level']:
                 nick = what
                 if 'group' not in nick: nick = 'group_'+nick
-                dat[nick] = group.__dict__[what]
+                dat[nick] = getattr(group, what)
 
             print format%dat
             continue
         return
 
-    def hierarchy(self):
-        '''Return database with groups and entries organized into a
-        hierarchy'''
-        from hier import Node
-
-        top = Node()
-        breadcrumb = [top]
-        node_by_id = {None:top}
-        for group in self.groups:
-            n = Node(group)
-            node_by_id[group.groupid] = n
-
-            #print group.group_name,group.level,group.groupid,breadcrumb[-1].level()
+    def resolve(self, path):
+        '''Return the list of groups and entries at the given path, eg.
+        "/Servers/Prod/db01", see hier.Tree.lookup()'''
+        return self.tree().lookup(path)
 
-            while group.level - breadcrumb[-1].level() != 1:
-                pn = breadcrumb.pop()
-                #print '\tpopped node:',pn.name()
-                continue
-
-            breadcrumb[-1].nodes.append(n)
-            breadcrumb.append(n)
-            continue
+    def glob(self, pattern):
+        '''Return the list of groups and entries matching the given
+        path pattern, eg. "/Servers/*/db*", see hier.Tree.glob()'''
+        return self.tree().glob(pattern)
 
-        for ent in self.entries:
-            n = node_by_id[ent.groupid]
-            n.entries.append(ent)
-
-        return top
+    def hierarchy(self):
+        '''Return the top hier.Node of the groups and entries organized
+        into a hierarchy.  It is that of tree() and so stays in step
+        with the database.'''
+        return self.tree().top
 
-    def update(self,hierarchy):
+    def update(self,groups,entries=None):
         '''
-        Update the database using the given hierarchy.  
-        This replaces the existing groups and entries.
+        Update the database using the given groups and entries, or the
+        given hierarchy (a hier.Node) if entries is None.  This replaces
+        the existing groups and entries, unless the hierarchy is this
+        database's own, which is always up to date.
         '''
-        import hier
-        collector = hier.CollectVisitor()
-        hierarchy.visit(collector)
-        self.update(collector.groups,collector.entries)
+        if entries is None:
+            import hier
+            top = groups
+            if self._tree is not None and top is self._tree.top:
+                return
+            collector = hier.CollectVisitor()
+            hier.visit(top,collector)
+            groups,entries = collector.groups,collector.entries
+        self.groups = groups
+        self.entries = entries
         return
 
-    def update(self,groups,entries):
+    def groupid_allocator(self):
+        'Return an alloc.IdAllocator which avoids the group IDs in use'
+        from alloc import IdAllocator
+        used = self.group_index().table('groupid')
+        if self._groupids is None or self._groupids.used is not used:
+            taken = self._groupids and self._groupids.taken
+            self._groupids = IdAllocator(used, taken)
+        return self._groupids
+
+    def uuid_allocator(self):
+        'Return an alloc.UuidAllocator which avoids the UUIDs in use'
+        from alloc import UuidAllocator
+        used = self.entry_index().table('uuid')
+        if self._uuids is None or self._uuids.used is not used:
+            taken = self._uuids and self._uuids.taken
+            self._uuids = UuidAllocator(used, taken)
+        return self._uuids
+
+    def gen_uuid(self, count=None):
+        '''Return a fresh UUID for an entry, or a list of count of
+        them, as a hex string'''
+        if count is None:
+            return self.uuid_allocator().allocate()
+        return self.uuid_allocator().reserve(count)
+
+    def gen_groupid(self, count=None):
+        '''Return a fresh, unique group ID, or a list of count of
+        them'''
+        if count is None:
+            return self.groupid_allocator().allocate()
+        return self.groupid_allocator().reserve(count)
+
+    def make_entries(self, items, now=None):
+        '''Return new EntryInfo objects for the mappings of field
+        values in items, see infoblock.make_entries().  Their UUIDs are
+        unique in this database.  The entries are not added to it.'''
+        import infoblock
+        return infoblock.make_entries(items, now, self.uuid_allocator())
+
+    def import_entries(self, records, append=False):
         '''
-        Update the database using the given groups and entries.  This
-        replaces the existing groups and entries.
+        Add entries in bulk from an iterable of mappings of entry field
+        names to values, each also giving the 'path' of its group as a
+        list of group names or a '/' separated string.  Integer and
+        time fields may be given as strings.  The missing groups are
+        made once for all records.
+
+        Unless append is True, an entry in the same group with the same
+        title and username as a record is updated from it instead of a
+        new entry being added, a missing title or username counting as
+        the default of the field.  A record giving a UUID updates the
+        entry with that UUID, if any, whether or not append is True,
+        since UUIDs identify entries (see merge).  Return the numbers
+        of entries added and updated.
         '''
-        self.groups = groups
-        self.entries = entries
-        return
+        import hier, infoblock
 
-    def gen_uuid(self):
-        "Generate 16 bytes of randomness suitable for an entry's UUID"
-        return 4                # only call once
+        coders = dict((name, coder) for name, coder, default
+                      in EntryInfo.format.itervalues() if name)
+        defaults = dict((name, default()) for name, coder, default
+                        in EntryInfo.format.itervalues() if name in ('title', 'username'))
+        now = infoblock.current_time()
+
+        items = []
+        paths = {}
+        for record in records:
+            item = dict(record)
+            path = tuple(import_value(None, name)
+                         for name in hier.path2list(item.pop('path', '')) if name)
+            for name, value in item.items():
+                if name not in coders:
+                    raise ValueError, 'unknown entry field "%s"' % name
+                item[name] = import_value(coders[name], value)
+                if item[name] is None:
+                    del item[name]
+                continue
+            items.append((path, item))
+            paths[path] = None
+            continue
+
+        for path in paths:
+            group = self.mkdir(path)
+            if group is None:
+                raise ValueError, 'entries can not be at the top, give a group path'
+            paths[path] = group.groupid
+            continue
 
-    def gen_groupid(self):
-        "Generate 4 bytes of randomness suitable for a group's unique group id"
-        groupid = randrange(1, 2**32-1)
-        if groupid in [g.groupid for g in self.groups]:
-            return self.gen_groupid()
+        if append:
+            existing = {}
         else:
-            return groupid                # only call once
+            existing = dict(((entry.groupid, entry.title, entry.username), entry)
+                            for entry in reversed(self.entries))
+        uuids = {}              # UUID -> the new item giving it
+        new = []
+        updated = 0
+        for path, item in items:
+            item['groupid'] = paths[path]
+            key = (item['groupid'], item.get('title', defaults['title']),
+                   item.get('username', defaults['username']))
+            uuid = item.get('uuid')
+            if uuid is None:
+                found = existing.get(key)
+            else:
+                found = uuids.get(uuid)
+                if found is None:
+                    found = (self.find(uuid=uuid) or [None])[0]
+            if found is None:
+                new.append(item)
+                if uuid is not None:
+                    uuids[uuid] = item
+                if not append:
+                    existing[key] = item
+            elif isinstance(found, dict):
+                found.update(item)
+            else:
+                for name, value in item.iteritems():
+                    setattr(found, name, value)
+                    continue
+                found.last_mod_time = now
+                updated += 1
+            continue
+
+        for entry in self.make_entries(new, now):
+            self.append_entry(entry)
+            continue
+        return len(new), updated
 
     def add_entry(self,path,title,username,password,url="",notes="",imageid=1,append=True):
         '''
@@ -327,36 +954,123 @@ class Database(object):
         append is False a pre-existing entry that matches path, title
         and username will be overwritten with the new one.
         '''
-        import hier, infoblock
-
-        top = self.hierarchy()
-        node = hier.mkdir(top,path)
-
-        # fixme, this should probably be moved into a new constructor
-        def make_entry():
-            new_entry = infoblock.EntryInfo()
-            new_entry.uuid = self.gen_uuid()
-            new_entry.groupid = group.groupid
-            new_entry.imageid = imageid
-            new_entry.title = title
-            new_entry.url = url
-            new_entry.username = username
-            new_entry.password = password
-            new_entry.notes = notes
-            #fixme, deal with times
-            return new_entry
-
-        if append:
-            self.entries.append(make_entry())
-            return
-
-        for ent in self.entries:
-            if ent.title != title: continue
-            if ent.username != username: continue
-            ent = make_entry()
-            return
-
-        self.entries.append(make_entry())
+        group = self.mkdir(path)
+        if group is None:
+            raise ValueError, 'entries can not be at the top, give a group path'
+
+        if not append:
+            for ent in self.find(title=title, username=username, groupid=group.groupid):
+                self.remove_entry(ent)
+                break
+
+        new_entry, = self.make_entries([dict(
+                groupid=group.groupid, imageid=imageid, title=title,
+                url=url, username=username, password=password, notes=notes)])
+        self.append_entry(new_entry)
         
     pass
 
+def import_value(coder, value):
+    '''Return the value to set for a field with the given coder from
+    an imported value, which may be a string, or None to leave the
+    field unset'''
+    from coder import IntCoder, ShortCoder, DatetimeCoder
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    if not isinstance(value, str):
+        return value
+    if isinstance(coder, (IntCoder, ShortCoder)):
+        if not value.strip(): return None
+        return int(value)
+    if isinstance(coder, DatetimeCoder):
+        if not value.strip(): return None
+        from datetime import datetime
+        return datetime.strptime(value.strip(), '%Y-%m-%d %H:%M:%S')
+    return value
+
+def mapview(mm, offset=0, size=None):
+    'Return a view of size bytes of the memory map starting at offset'
+    if size is None:
+        size = len(mm) - offset
+    try:
+        return memoryview(mm)[offset:offset+size]
+    except TypeError:           # Python 2 mmap has only the old buffer interface
+        return buffer(mm, offset, size)
+
+def unlock_file(job):
+    '''Decrypt one file in a worker process of open_many().  The job
+    is (position, filename, credential keyword arguments).  Return
+    (position, header, transformed key, payload, None) or, if that
+    failed, (position, None, None, None, exception).'''
+    ind, filename, credentials = job
+    try:
+        db = Database(**credentials)
+        payload = db.decrypt_file(filename)
+    except Exception, err:
+        return ind, None, None, None, err
+    return ind, db.header.encode(), db._transformed, payload, None
+
+def open_many(specs, workers=None, **kwds):
+    '''
+    Open many .kdb files, transforming their keys and decrypting
+    them in a pool of worker processes, at most workers of them
+    (default: one per CPU).  Generate (filename, database, None) or,
+    for a file which could not be opened, (filename, None, exception)
+    as each file is done, in no particular order.
+
+    Each spec is a filename or a mapping of Database keyword
+    arguments including the filename.  Keyword arguments are the
+    defaults for all specs, eg. the passphrase.  Credentials and the
+    decrypted payloads only pass between this process and the
+    workers, through the pipes of the pool; the payloads are parsed
+    here.
+    '''
+    from multiprocessing import Pool, cpu_count
+
+    credential_names = ('masterkey', 'filekey', 'passphrase')
+    jobs = []
+    options = []
+    for spec in specs:
+        if isinstance(spec, basestring):
+            spec = dict(filename=spec)
+        spec = dict(kwds, **spec)
+        filename = spec.pop('filename')
+        credentials = dict((name, spec.pop(name, None)) for name in credential_names)
+        jobs.append((len(jobs), filename, credentials))
+        options.append((filename, credentials, spec))
+        continue
+    if not jobs:
+        return
+
+    pool = Pool(min(workers or cpu_count(), len(jobs)))
+    try:
+        for ind, header, transformed, payload, error in \
+                pool.imap_unordered(unlock_file, jobs):
+            filename, credentials, spec = options[ind]
+            db = None
+            if error is None:
+                spec = dict(spec)
+                prederive = spec.pop('prederive', False)
+                index_search = spec.pop('index_search', False)
+                try:
+                    db = Database(**dict(spec, **credentials))
+                    db.filename = filename
+                    db.load(header, payload, transformed)
+                except Exception, error:
+                    db = None
+                else:
+                    if prederive:
+                        db.start_keypool()
+                    if index_search:
+                        db.search_index()
+            yield filename, db, error
+            continue
+    finally:
+        pool.terminate()
+        pool.join()
+    return
+
+def iter_entries(filename, chunksize=65536, **kwds):
+    '''Generate the entries of the given .kdb file as they are
+    decrypted.  Keyword arguments are passed to the Database.'''
+    return Database(**kwds).iter_entries(filename, chunksize)
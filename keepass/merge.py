@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+'''
+Merging of several databases into one.
+
+The groups of each database are reconciled with those already
+merged by their path: a group whose path exists is the same group,
+whatever its ID, and a new group keeps its ID unless that is taken,
+in which case it gets a fresh one.  Entries are joined by UUID
+through the hash tables of the merged database's entry index.  An
+entry new to it is copied in, into the group matching its own; an
+entry it already has is left alone if equal, or else a policy picks
+which of the two versions to keep.  Each group and entry is looked
+at once, so the merge takes time linear in the number of records.
+
+A policy is called as policy(ours, theirs) with the entry already
+merged and the one being merged, and returns the one to keep.  The
+default, newest(), keeps the one modified last.
+
+Meta streams (the "Meta-Info" entries KeePass keeps its settings
+in) all have the null UUID and can not be joined; those of the
+first database are kept and those of the others skipped.
+'''
+
+from infoblock import GroupInfo, EntryInfo
+
+null_uuid = '0'*32
+
+def newest(ours, theirs):
+    'Keep the entry modified last, ours if both were modified together'
+    if theirs.last_mod_time > ours.last_mod_time:
+        return theirs
+    return ours
+
+def keep_ours(ours, theirs):
+    'Always keep the entry already merged'
+    return ours
+
+def take_theirs(ours, theirs):
+    'Always take the entry being merged'
+    return theirs
+
+policies = {'newest': newest, 'ours': keep_ours, 'theirs': take_theirs}
+
+def is_meta_stream(entry):
+    'Return True if the entry is a KeePass meta stream'
+    return entry.uuid == null_uuid and entry.title == 'Meta-Info' and \
+        entry.username == 'SYSTEM' and entry.url == '$'
+
+class Report(object):
+    '''
+    What a merge did with each record.  The entries list holds one
+    (action, source, uuid, title) for each entry of the databases
+    merged into the first one, the action being one of:
+
+     * added - the entry was new and was copied in
+     * updated - the entry differed and this version was taken
+     * kept - the entry differed and the merged version was kept
+     * same - the entry was already there as is
+     * skipped - a meta stream or an entry of no group, not merged
+
+    The groups list holds (source, old groupid, new groupid, path)
+    for each group whose ID changed.  The source is the file name of
+    the database, or its position if it has none.
+    '''
+
+    actions = ('added', 'updated', 'kept', 'same', 'skipped')
+
+    def __init__(self):
+        self.entries = []
+        self.groups = []
+        return
+
+    def counts(self):
+        'Return a dictionary mapping each action to its number of entries'
+        ret = dict((action, 0) for action in self.actions)
+        for action, source, uuid, title in self.entries:
+            ret[action] += 1
+            continue
+        return ret
+
+    def summary(self):
+        'Return a one line summary of the counts'
+        counts = self.counts()
+        return ', '.join('%d %s' % (counts[action], action) for action in self.actions)
+
+    def __str__(self):
+        ret = []
+        for action, source, uuid, title in self.entries:
+            ret.append('%-8s %s %s %s' % (action, source, uuid, title))
+            continue
+        for source, old, new, path in self.groups:
+            ret.append('%-8s %s group %s: %d -> %d' % ('remapped', source, '/'.join(path), old, new))
+            continue
+        ret.append(self.summary())
+        return '\n'.join(ret)
+
+    pass
+
+def merge(databases, policy=None):
+    '''Merge the groups and entries of all the databases into the
+    first one, see module documentation.  Return the first database
+    and the Report of the merge.'''
+    if policy is None:
+        policy = newest
+    databases = list(databases)
+    target = databases[0]
+    report = Report()
+    for ind, source in enumerate(databases[1:]):
+        merge_into(target, source, policy, report, source_name(source, ind+1))
+        continue
+    return target, report
+
+def source_name(db, ind):
+    'Return how the report names the database'
+    return getattr(db, 'filename', None) or str(ind)
+
+def merge_into(target, source, policy, report, name):
+    '''Merge the groups and entries of the source database into the
+    target one, recording what was done in the report'''
+    groupids = merge_groups(target, source, report, name)
+    uuids = target.entry_index()
+
+    for entry in source.entries:
+        groupid = groupids.get(entry.groupid)
+        if groupid is None or is_meta_stream(entry):
+            report.entries.append(('skipped', name, entry.uuid, entry.title))
+            continue
+        fields = entry.asdict()
+        fields['groupid'] = groupid
+
+        found = uuids.lookup('uuid', entry.uuid)
+        if not found:
+            target.append_entry(EntryInfo(**fields))
+            report.entries.append(('added', name, entry.uuid, entry.title))
+            continue
+
+        ours = found[0]
+        if ours.asdict() == fields:
+            action = 'same'
+        elif policy(ours, entry) is ours:
+            action = 'kept'
+        else:
+            action = 'updated'
+            for field, value in fields.iteritems():
+                setattr(ours, field, value)
+                continue
+        report.entries.append((action, name, entry.uuid, entry.title))
+        continue
+    return
+
+def merge_groups(target, source, report, name):
+    '''Reconcile the groups of the source with those of the target by
+    path, adding the missing ones.  Return a map from the group IDs
+    of the source to those of the target.'''
+    tree = target.tree()
+    allocator = target.groupid_allocator()
+    groupids = {}
+
+    # pairs of a source node and the target node of its parent
+    stack = [(node, tree.top) for node in reversed(source.tree().top.nodes)]
+    while stack:
+        node, parent = stack.pop()
+        group = node.group
+        ours = parent.child(group.group_name)
+        if ours is None:
+            fields = group.asdict()
+            if group.groupid in allocator:
+                fields['groupid'] = target.gen_groupid()
+            new = GroupInfo(**fields)
+            target.append_group(new, parent.group)
+            ours = tree.node(new)
+        groupids.setdefault(group.groupid, ours.group.groupid)
+        if ours.group.groupid != group.groupid:
+            report.groups.append((name, group.groupid, ours.group.groupid, ours.path()))
+        stack.extend((child, ours) for child in reversed(node.nodes))
+        continue
+    return groupids
@@ -60,10 +60,9 @@ def main():
         for entry in db.entries:
             if hasattr(entry, 'title') and entry.title == 'Meta-Info':
                 continue
-            for group in db.groups:
-                if hasattr(entry, 'groupid') and group.groupid == entry.groupid:
-                    break
-            print("{0:<20} {1:15} {2:20} {3:20}".format(group.group_name, entry.title,
+            group = db.entry_group(entry)
+            group_name = group.group_name if group else ""
+            print("{0:<20} {1:15} {2:20} {3:20}".format(group_name, entry.title,
                                                         entry.username, entry.url))
 
     elif command == 'get':
@@ -82,7 +81,7 @@ def main():
         elif command == 'add':
             entry = EntryInfo()
             entry.title = title
-            db.entries.append(entry)
+            db.append_entry(entry)
         for (key, value) in setpairs.items():
             setattr(entry, key, value)
         db.write()
@@ -90,7 +89,7 @@ def main():
     elif command == 'del':
         title = args[2]
         entry = db.get(title)
-        db.entries.remove(entry)
+        db.remove_entry(entry)
         db.write()
 
 if __name__ == '__main__':
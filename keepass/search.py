@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+'''
+Full text search over the string fields of entries.
+
+A SearchIndex keeps an inverted index from the lower case words
+(tokens) of the titles, usernames, URLs, notes and attachment names
+of entries to the entries holding them, with how often each does.
+Passwords are not indexed.  The tokens themselves are indexed by
+their trigrams, with the start of a token marked, so that prefix
+terms find their tokens without scanning all of them.
+
+Queries are whitespace separated terms, all of which an entry must
+match.  A term ending in '*' matches tokens starting with it.
+Matches are ranked by term frequency times inverse document
+frequency, weighted by field.
+
+Like index.Index, the index listens to the entries it holds so that
+edits to their fields are reflected at once.  Entries must be added
+and removed through the index (or the Database methods using it).
+'''
+
+import re, heapq
+from math import log
+from operator import itemgetter
+
+tokenize = re.compile(r'\w+').findall
+
+def trigrams(token):
+    'Return the set of trigrams of the token, with its start marked by ^^'
+    marked = '^^' + token
+    return set(marked[ind:ind+3] for ind in range(len(marked)-2))
+
+class SearchIndex(object):
+    '''
+    Inverted token and trigram index over the string fields of entries.
+    '''
+
+    # indexed fields and the weight of their matches
+    weights = {'title': 3.0, 'username': 2.0, 'url': 2.0,
+               'notes': 1.0, 'binary_desc': 1.0}
+
+    def __init__(self, entries, weights=None):
+        if weights is not None:
+            self.weights = weights
+        self.entries = entries
+        self.postings = {}      # token -> {entry: weighted frequency}
+        self.grams = {}         # trigram -> set of tokens
+        self.count = 0
+        for entry in entries:
+            self.add_entry(entry)
+            continue
+        return
+
+    def current(self, entries):
+        'Return True if this index still describes the given list'
+        return entries is self.entries and len(entries) == self.count
+
+    def _tokens(self, value):
+        if not isinstance(value, basestring):
+            return []
+        return tokenize(value.lower())
+
+    def _add(self, entry, tokens, weight):
+        for token in tokens:
+            posting = self.postings.get(token)
+            if posting is None:
+                posting = self.postings[token] = {}
+                for gram in trigrams(token):
+                    self.grams.setdefault(gram, set()).add(token)
+                    continue
+            posting[entry] = posting.get(entry, 0.0) + weight
+            continue
+        return
+
+    def _remove(self, entry, tokens, weight):
+        for token in tokens:
+            posting = self.postings.get(token)
+            if posting is None or entry not in posting: continue
+            left = posting[entry] - weight
+            if left > 1e-9:
+                posting[entry] = left
+                continue
+            del posting[entry]
+            if posting: continue
+            del self.postings[token]
+            for gram in trigrams(token):
+                holders = self.grams[gram]
+                holders.discard(token)
+                if not holders:
+                    del self.grams[gram]
+                continue
+            continue
+        return
+
+    def add_entry(self, entry):
+        'Index the entry'
+        for field, weight in self.weights.iteritems():
+            self._add(entry, self._tokens(getattr(entry, field, None)), weight)
+            continue
+        entry.add_listener(self)
+        self.count += 1
+        return
+
+    def remove_entry(self, entry):
+        'Drop the entry from the index'
+        for field, weight in self.weights.iteritems():
+            self._remove(entry, self._tokens(getattr(entry, field, None)), weight)
+            continue
+        entry.remove_listener(self)
+        self.count -= 1
+        return
+
+    def changed(self, record, field, old, new):
+        'Called by an entry when one of its attributes is set'
+        weight = self.weights.get(field)
+        if weight is None or old == new: return
+        self._remove(record, self._tokens(old), weight)
+        self._add(record, self._tokens(new), weight)
+        return
+
+    def detach(self):
+        'Stop listening to all entries'
+        for entry in self.entries:
+            entry.remove_listener(self)
+            continue
+        return
+
+    def expand(self, term):
+        '''Return the indexed tokens matching the term, a word or, if it
+        ends with '*', a prefix'''
+        if not term.endswith('*'):
+            if term in self.postings: return [term]
+            return []
+        prefix = term[:-1]
+        if not prefix:
+            return []
+        found = None
+        for gram in trigrams(prefix):
+            tokens = self.grams.get(gram)
+            if not tokens: return []
+            if found is None or len(tokens) < len(found):
+                found = tokens
+            continue
+        return [token for token in found if token.startswith(prefix)]
+
+    def _scores(self, term):
+        'Return a map from the entries matching the term to their score'
+        tokens = self.expand(term)
+        if len(tokens) == 1:
+            posting = self.postings[tokens[0]]
+            idf = log(1.0 + float(self.count)/len(posting))
+            return dict((entry, freq*idf) for entry, freq in posting.iteritems())
+        scores = {}
+        for token in tokens:
+            posting = self.postings[token]
+            idf = log(1.0 + float(self.count)/len(posting))
+            for entry, freq in posting.iteritems():
+                score = freq*idf
+                if score > scores.get(entry, 0.0):
+                    scores[entry] = score
+                continue
+            continue
+        return scores
+
+    def search(self, query, limit=None):
+        '''Return a list of (score, entry) for the entries matching all
+        terms of the query, best first, at most limit of them'''
+        terms = []
+        for word in query.lower().split():
+            prefix = word.endswith('*')
+            tokens = tokenize(word)
+            for ind, token in enumerate(tokens):
+                if prefix and ind == len(tokens)-1:
+                    token += '*'
+                terms.append(token)
+                continue
+            continue
+        if not terms:
+            return []
+
+        results = None
+        for scores in sorted((self._scores(term) for term in terms), key=len):
+            if results is None:
+                results = scores
+            else:
+                results = dict((entry, score + scores[entry])
+                               for entry, score in results.iteritems() if entry in scores)
+            if not results: return []
+            continue
+
+        if limit is not None and limit < len(results):
+            best = heapq.nlargest(limit, results.iteritems(), key=itemgetter(1))
+        else:
+            best = results.iteritems()
+        return sorted(((score, entry) for entry, score in best),
+                      key=lambda pair: (-pair[0], pair[1].title))
+
+    pass
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+'''
+Engines for the AES key transformation ("key stretching").
+
+The composite key is encrypted with AES-ECB under the transform seed
+for the number of rounds given in the header.  ECB treats each 16
+byte block independently so the two halves of the 32 byte key can be
+transformed separately and the results concatenated.
+
+An engine is a callable
+
+    engine(key, seed, rounds) -> transformed key
+
+Engines run the rounds in chunks.  Between chunks they report
+progress to an optional callable
+
+    progress(rounds_done, rounds_total)
+
+and consult an optional cancel hook, which may be a callable
+returning True or an object with an is_set() method such as a
+threading.Event.  A cancelled transform raises TransformCancelled.
+'''
+
+import sys, threading
+from Crypto.Cipher import AES
+
+class TransformCancelled(Exception):
+    'Raised when a key transformation is cancelled'
+    pass
+
+class TransformEngine(object):
+    '''
+    Run all rounds in the calling thread.
+    '''
+
+    chunk = 65536               # rounds between progress/cancel checks
+
+    def __init__(self, progress=None, cancel=None, chunk=None):
+        self.progress = progress
+        if cancel is not None and hasattr(cancel, 'is_set'):
+            cancel = cancel.is_set
+        self.cancel = cancel
+        if chunk:
+            self.chunk = chunk
+        return
+
+    def cancelled(self):
+        'Return True if the cancel hook says to stop'
+        return bool(self.cancel and self.cancel())
+
+    def report(self, done, total):
+        'Pass progress on to the callback, if any'
+        if self.progress:
+            self.progress(done, total)
+        return
+
+    def __call__(self, key, seed, rounds):
+        encrypt = AES.new(seed, AES.MODE_ECB).encrypt
+        done = 0
+        while done < rounds:
+            if self.cancelled():
+                raise TransformCancelled, 'cancelled after %d of %d rounds'%(done, rounds)
+            todo = min(self.chunk, rounds - done)
+            for i in xrange(todo):
+                key = encrypt(key)
+                continue
+            done += todo
+            self.report(done, rounds)
+            continue
+        return key
+
+    pass
+
+class SplitTransformEngine(TransformEngine):
+    '''
+    Transform each 16 byte block of the key in its own worker thread.
+
+    The calling thread waits on the workers, reporting progress as
+    the slowest of them and passing on any cancellation, and raises
+    any exception of a worker.  The result is identical to that of
+    TransformEngine.
+
+    PyCrypto holds the GIL while encrypting, so the workers do not
+    run in parallel and the switching between them makes this engine
+    about twice as slow as TransformEngine with that backend.  It is
+    only of use with an AES module releasing the GIL.
+    '''
+
+    interval = 0.1              # seconds between progress reports
+
+    def __call__(self, key, seed, rounds):
+        if len(key) % AES.block_size or len(key) == AES.block_size:
+            return super(SplitTransformEngine, self).__call__(key, seed, rounds)
+
+        blocks = [key[ind:ind+AES.block_size]
+                  for ind in range(0, len(key), AES.block_size)]
+        done = [0]*len(blocks)
+        errors = []
+        stop = threading.Event()
+        chunk = self.chunk
+
+        def work(ind):
+            try:
+                encrypt = AES.new(seed, AES.MODE_ECB).encrypt
+                block = blocks[ind]
+                while done[ind] < rounds:
+                    if stop.is_set(): return
+                    todo = min(chunk, rounds - done[ind])
+                    for i in xrange(todo):
+                        block = encrypt(block)
+                        continue
+                    blocks[ind] = block
+                    done[ind] += todo
+                    continue
+            except Exception:
+                errors.append(sys.exc_info())
+                stop.set()
+            return
+
+        workers = [threading.Thread(target=work, args=(ind,))
+                   for ind in range(len(blocks))]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+            continue
+
+        reported = 0
+        for worker in workers:
+            while worker.is_alive():
+                worker.join(self.interval)
+                if self.cancelled():
+                    stop.set()
+                    for other in workers: other.join()
+                    raise TransformCancelled, \
+                        'cancelled after %d of %d rounds'%(min(done), rounds)
+                if errors: break
+                if min(done) != reported:
+                    reported = min(done)
+                    self.report(reported, rounds)
+                continue
+            continue
+
+        if errors:
+            for worker in workers: worker.join()
+            typ, value, traceback = errors[0]
+            raise typ, value, traceback
+        assert all(count == rounds for count in done), \
+            'workers did %s of %d rounds' % (done, rounds)
+        if reported != rounds:
+            self.report(rounds, rounds)
+        return ''.join(blocks)
+
+    pass
+
+def calibrate(target=1.0, engine=None, sample=0.1):
+    '''
+    Return the number of transform rounds which take about target
+    seconds with the given engine on this machine.
+
+    The engine is timed on increasing numbers of rounds until one run
+    takes at least sample seconds and the result is extrapolated.
+    '''
+    import os, time
+    engine = engine or TransformEngine()
+    key = os.urandom(32)
+    seed = os.urandom(32)
+    rounds = 1000
+    while True:
+        start = time.time()
+        engine(key, seed, rounds)
+        elapsed = time.time() - start
+        if elapsed >= sample: break
+        rounds *= 2
+        continue
+    return max(1, min(2**32-1, int(rounds * target / elapsed)))
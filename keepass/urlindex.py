@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+'''
+Index of entries by the host of their URL, for finding the entries
+to offer on a given site.
+
+Each entry URL is split into scheme, host, port and path.  The host
+labels are stored reversed (com, example, www) in a trie, so looking
+up a host walks one node per label and meets the entries of the host
+and of all its parent domains on the way.  Matches are ranked by how
+many labels they share with the host, then by whether port, scheme
+and path agree.
+
+Like index.Index, the index listens to the entries it holds so that
+a changed URL is re-indexed at once.  Entries must be added and
+removed through the index (or the Database methods using it).
+'''
+
+import re
+from urlparse import urlsplit
+
+default_ports = {'http': 80, 'https': 443, 'ftp': 21, 'ssh': 22,
+                 'sftp': 22, 'ldap': 389, 'ldaps': 636, 'rdp': 3389}
+
+ipv4 = re.compile(r'^\d+\.\d+\.\d+\.\d+$')
+word = re.compile(r'\w')
+
+def parse_url(url):
+    '''Return (scheme, host labels, port, path) of the URL, or None if
+    it has no host (such as the '$' of meta entries).  A URL without a scheme is taken to start with the
+    host.  The host labels are lower case and in their usual order,
+    except that an IP address is kept as one label.  The port is the
+    default one of the scheme if not given, or None if unknown.'''
+    if not isinstance(url, basestring):
+        return None
+    url = url.strip()
+    if '://' not in url:
+        url = '//' + url
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return None
+    host = (parts.hostname or '').rstrip('.')
+    if not word.search(host):
+        return None
+    scheme = parts.scheme.lower()
+    if port is None:
+        port = default_ports.get(scheme)
+    if ipv4.match(host) or ':' in host:
+        labels = [host]
+    else:
+        labels = host.split('.')
+    return scheme, labels, port, parts.path or '/'
+
+class UrlNode(object):
+    'One host label of the trie'
+
+    __slots__ = ('children', 'entries')
+
+    def __init__(self):
+        self.children = {}      # next label -> UrlNode
+        self.entries = []       # (entry, parsed URL) of this host
+        return
+
+    pass
+
+class UrlIndex(object):
+    '''
+    Reversed host label trie over the URLs of entries.
+    '''
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.root = UrlNode()
+        self.count = 0
+        for entry in entries:
+            self.add_entry(entry)
+            continue
+        return
+
+    def current(self, entries):
+        'Return True if this index still describes the given list'
+        return entries is self.entries and len(entries) == self.count
+
+    def _insert(self, entry, url):
+        parsed = parse_url(url)
+        if parsed is None: return
+        node = self.root
+        for label in reversed(parsed[1]):
+            child = node.children.get(label)
+            if child is None:
+                child = node.children[label] = UrlNode()
+            node = child
+            continue
+        node.entries.append((entry, parsed))
+        return
+
+    def _delete(self, entry, url):
+        parsed = parse_url(url)
+        if parsed is None: return
+        labels = list(reversed(parsed[1]))
+        path = [self.root]
+        for label in labels:
+            node = path[-1].children.get(label)
+            if node is None: return
+            path.append(node)
+            continue
+        node = path[-1]
+        for ind, (other, where) in enumerate(node.entries):
+            if other is entry:
+                del node.entries[ind]
+                break
+            continue
+        # prune the nodes left empty
+        for ind in range(len(labels), 0, -1):
+            node = path[ind]
+            if node.entries or node.children: break
+            del path[ind-1].children[labels[ind-1]]
+            continue
+        return
+
+    def add_entry(self, entry):
+        'Index the entry'
+        self._insert(entry, getattr(entry, 'url', None))
+        entry.add_listener(self)
+        self.count += 1
+        return
+
+    def remove_entry(self, entry):
+        'Drop the entry from the index'
+        self._delete(entry, getattr(entry, 'url', None))
+        entry.remove_listener(self)
+        self.count -= 1
+        return
+
+    def changed(self, record, field, old, new):
+        'Called by an entry when one of its attributes is set'
+        if field != 'url' or old == new: return
+        self._delete(record, old)
+        self._insert(record, new)
+        return
+
+    def detach(self):
+        'Stop listening to all entries'
+        for entry in self.entries:
+            entry.remove_listener(self)
+            continue
+        return
+
+    def match(self, url, limit=None):
+        '''Return a list of the entries for the host of the URL or one
+        of its parent domains, best match first, at most limit of
+        them.  An entry for the host itself comes before one for a
+        parent domain; among those, the entries whose port, scheme
+        and path agree with the URL come first.'''
+        parsed = parse_url(url)
+        if parsed is None:
+            return []
+        scheme, labels, port, path = parsed
+
+        ranked = []
+        node = self.root
+        for depth, label in enumerate(reversed(labels)):
+            node = node.children.get(label)
+            if node is None: break
+            for entry, (escheme, elabels, eport, epath) in node.entries:
+                rank = (depth, eport == port, escheme == scheme,
+                        path.startswith(epath) and len(epath))
+                ranked.append((rank, entry))
+                continue
+            continue
+
+        ranked.sort(key=lambda pair: pair[0], reverse=True)
+        if limit is not None:
+            ranked = ranked[:limit]
+        return [entry for rank, entry in ranked]
+
+    pass
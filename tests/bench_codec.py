@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+'''
+Time decoding and encoding of the group and entry records of a file,
+against a reference codec which compiles a struct format per field
+and goes through the format table for every field.
+
+usage: bench_codec.py [file.kdb [passphrase [repeat]]]
+'''
+
+import sys, os, struct, timeit
+from keepass import kpdb, infoblock
+
+testkdb = os.path.join(os.path.dirname(__file__), 'test.kdb')
+
+def reference_decode(cls, string):
+    'Decode one record the way InfoBase.decode() did before codecs()'
+    rec = cls.__new__(cls)
+    offset = 0
+    while True:
+        typ, siz = struct.unpack('<H I', string[offset:offset+6])
+        offset += 6
+        if typ == 0xFFFF: break
+        buf = struct.unpack('<%ds'%siz, string[offset:offset+siz])[0]
+        offset += siz
+        name, coder, default = cls.format[typ]
+        object.__setattr__(rec, name, coder.decode(buf))
+        continue
+    return rec
+
+def reference_encode(rec):
+    'Encode one record the way InfoBase.encode() did before codecs()'
+    pieces = []
+    for typ in rec.format:
+        name, coder, default = rec.format[typ]
+        encoded = None
+        if name is not None:
+            encoded = coder.encode(getattr(rec, name, None))
+        siz = 0 if encoded is None else len(encoded)
+        buf = struct.pack('<H I', typ, siz)
+        typ, siz = struct.unpack('<H I', buf)
+        pieces.append(buf)
+        if encoded is not None:
+            pieces.append(encoded)
+        continue
+    return ''.join(pieces)
+
+def timed(funcs, repeat, count, rounds=15):
+    '''Return the best time per record in microseconds of each function.
+    The functions take turns so they see the same machine load.'''
+    best = [None]*len(funcs)
+    for ind in range(rounds):
+        for which, func in enumerate(funcs):
+            took = timeit.timeit(func, number=repeat)
+            if best[which] is None or took < best[which]:
+                best[which] = took
+            continue
+        continue
+    return [1e6*took/(repeat*count) for took in best]
+
+def bench(filename, passphrase, repeat=2000):
+    db = kpdb.Database(filename, passphrase=passphrase)
+    for cls, records in [(infoblock.GroupInfo, db.groups),
+                         (infoblock.EntryInfo, db.entries)]:
+        encoded = [rec.encode() for rec in records]
+        count = len(records)
+
+        tests = [
+            ('decode', lambda: [cls(string) for string in encoded],
+                       lambda: [reference_decode(cls, string) for string in encoded]),
+            ('encode', lambda: [rec.encode() for rec in records],
+                       lambda: [reference_encode(rec) for rec in records]),
+            ]
+        for what, new, old in tests:
+            new, old = timed([new, old], repeat, count)
+            print '%-10s %s: %6.1f us/record, reference %6.1f us/record (x%.2f)' % \
+                (cls.__name__, what, new, old, old/new)
+            continue
+        continue
+    return
+
+if '__main__' == __name__:
+    args = sys.argv[1:]
+    filename = args and args.pop(0) or testkdb
+    passphrase = args and args.pop(0) or 'test'
+    repeat = args and int(args.pop(0)) or 2000
+    bench(filename, passphrase, repeat)
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+'''
+Test the agent serving a database over a Unix domain socket
+'''
+
+import os, stat, shutil, socket, tempfile, threading, time
+import keepass
+from keepass import kpdb, agent
+
+testkdb = os.path.join(os.path.dirname(__file__), 'test.kdb')
+
+def start(db, idle_timeout=30):
+    server = agent.Agent(db, idle_timeout=idle_timeout)
+    thread = threading.Thread(target=server.serve)
+    thread.daemon = True
+    thread.start()
+    return server, thread
+
+def test_agent():
+    tmpdir = tempfile.mkdtemp()
+    environ = dict(os.environ)
+    os.environ['XDG_RUNTIME_DIR'] = tmpdir
+    try:
+        # a file opened with a key file too, as get_entry() expects
+        filename = os.path.join(tmpdir, 'vault.kdb')
+        filekey = os.urandom(32)
+        db = kpdb.Database(testkdb, passphrase='test')
+        db.filekey = filekey
+        db.write(filename)
+        os.mkdir(os.path.join(tmpdir, 'secure'))
+        fp = open(os.path.join(tmpdir, 'secure', 'vault.key'), 'w')
+        fp.write(filekey.encode('hex'))
+        fp.close()
+        expected = keepass.get_entry(filename, 'My Email Account', passphrase='test')
+
+        opened = kpdb.Database(filename, filekey=filekey, passphrase='test')
+        server, thread = start(opened)
+        mode = os.stat(server.path).st_mode
+        assert stat.S_ISSOCK(mode) and stat.S_IMODE(mode) == 0600
+        assert stat.S_IMODE(os.stat(os.path.dirname(server.path)).st_mode) == 0700
+
+        # the agent answers only when asked to
+        before = server.last_request
+        time.sleep(0.01)
+        entry = keepass.get_entry(filename, 'My Email Account', passphrase='test')
+        assert server.last_request == before
+        entry = keepass.get_entry(filename, 'My Email Account', passphrase='test',
+                                  use_agent=True)
+        assert entry.encode() == expected.encode()
+        assert server.last_request > before
+        try:
+            keepass.get_entry(filename, 'My Email Account', passphrase='WRONG')
+        except ValueError:
+            pass
+        else:
+            assert False, 'wrong passphrase accepted'
+
+        client = agent.connect(filename)
+        assert client.request('ping')['file'] == filename
+        assert [rec['title'] for rec in client.search('email')] == ['My Email Account']*2
+        assert all('password' not in rec for rec in client.list())
+        assert client.get(path='Backup/My Email Account').groupid == 3591618128
+        assert client.get('nothing') is None
+
+        started = time.time()
+        for count in range(1000):
+            client.get('My Email Account')
+            continue
+        took = (time.time() - started)/1000
+        assert took < 0.01, 'lookups take %.1f ms' % (took*1000)
+
+        # the credentials are checked
+        right = agent.connect(filename, opened.transformed_key())
+        assert right.get('My Email Account').encode() == expected.encode()
+        right.close()
+        wrong = agent.connect(filename, 'wrong key')
+        try:
+            wrong.get('My Email Account')
+        except agent.AgentError:
+            pass
+        else:
+            assert False, 'wrong key accepted'
+        wrong.close()
+
+        # nor is a socket in a directory others may use
+        directory = os.path.dirname(server.path)
+        os.chmod(directory, 0777)
+        try:
+            assert agent.connect(filename) is None
+            before = server.last_request
+            entry = keepass.get_entry(filename, 'My Email Account', passphrase='test',
+                                      use_agent=True)
+            assert entry.encode() == expected.encode()
+            assert server.last_request == before
+        finally:
+            os.chmod(directory, 0700)
+
+        client.lock()
+        client.close()
+        thread.join(5)
+        assert not thread.is_alive() and server.db is None
+        assert not os.path.exists(server.path)
+        assert agent.connect(filename) is None
+    finally:
+        os.environ.clear()
+        os.environ.update(environ)
+        shutil.rmtree(tmpdir)
+
+def test_file_changed():
+    tmpdir = tempfile.mkdtemp()
+    environ = dict(os.environ)
+    os.environ['XDG_RUNTIME_DIR'] = tmpdir
+    try:
+        filename = os.path.join(tmpdir, 'vault.kdb')
+        filekey = os.urandom(32)
+        db = kpdb.Database(testkdb, passphrase='test')
+        db.filekey = filekey
+        db.write(filename)
+        keyfilename = os.path.join(tmpdir, 'vault.key')
+        fp = open(keyfilename, 'w')
+        fp.write(filekey.encode('hex'))
+        fp.close()
+
+        server, thread = start(kpdb.Database(filename, filekey=filekey, passphrase='test'))
+        entry = keepass.get_entry(filename, 'My Email Account', keyfilename,
+                                  passphrase='test', use_agent=True)
+        assert entry.password == 'test'
+
+        # the agent locks instead of answering the old password
+        db.get('My Email Account').password = 'NEW'
+        db.write(filename)
+        entry = keepass.get_entry(filename, 'My Email Account', keyfilename,
+                                  passphrase='test', use_agent=True)
+        assert entry.password == 'NEW'
+        thread.join(5)
+        assert not thread.is_alive() and server.db is None
+        assert not os.path.exists(server.path)
+    finally:
+        os.environ.clear()
+        os.environ.update(environ)
+        shutil.rmtree(tmpdir)
+
+def test_idle_timeout():
+    tmpdir = tempfile.mkdtemp()
+    environ = dict(os.environ)
+    os.environ['XDG_RUNTIME_DIR'] = tmpdir
+    try:
+        server, thread = start(kpdb.Database(testkdb, passphrase='test'), 0.2)
+        client = agent.connect(testkdb)
+        assert client.get('My Email Account').username == 'nobody@example.com'
+        client.close()
+        thread.join(5)
+        assert not thread.is_alive() and not os.path.exists(server.path)
+    finally:
+        os.environ.clear()
+        os.environ.update(environ)
+        shutil.rmtree(tmpdir)
+
+if '__main__' == __name__:
+    test_agent()
+    test_file_changed()
+    test_idle_timeout()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+'''
+Test the group ID and UUID allocators
+'''
+
+import os, tempfile
+from keepass import kpdb, alloc
+
+testkdb = os.path.join(os.path.dirname(__file__), 'test.kdb')
+
+class Fixed(alloc.IdAllocator):
+    'Draw from a fixed sequence'
+    def __init__(self, values, used=None):
+        super(Fixed, self).__init__(used)
+        self.values = list(values)
+    def draw(self, count):
+        ret, self.values = self.values[:count], self.values[count:]
+        return ret
+
+def test_reserved_and_used():
+    allocator = Fixed([0, 5, 0xFFFFFFFF, 5, 6, 7], used=set([6]))
+    assert allocator.reserve(2) == [5, 7]
+    assert 5 in allocator and 6 in allocator and 0 in allocator
+
+def test_bulk():
+    ids = alloc.IdAllocator().reserve(1000)
+    assert len(set(ids)) == 1000
+    uuids = alloc.UuidAllocator().reserve(1000)
+    assert len(set(uuids)) == 1000 and all(len(u) == 32 for u in uuids)
+
+def test_database():
+    db = kpdb.Database(testkdb, passphrase='test')
+    groupids = db.gen_groupid(100)
+    assert not set(groupids) & set(g.groupid for g in db.groups)
+    assert db.gen_groupid() not in groupids
+    uuid = db.gen_uuid()
+    assert uuid not in [e.uuid for e in db.entries]
+    db.entries[0].uuid = uuid
+    assert db.find(uuid=uuid) == [db.entries[0]]
+
+def test_uuid_roundtrip():
+    db = kpdb.Database(testkdb, passphrase='test')
+    assert db.entries[0].uuid == '9810c64cede99d3e32d000aeeb538615'
+    fd, filename = tempfile.mkstemp(suffix='.kdb')
+    os.close(fd)
+    try:
+        db.write(filename)
+        db2 = kpdb.Database(filename, passphrase='test')
+    finally:
+        os.remove(filename)
+    assert [e.uuid for e in db2.entries] == [e.uuid for e in db.entries]
+
+if '__main__' == __name__:
+    test_reserved_and_used()
+    test_bulk()
+    test_database()
+    test_uuid_roundtrip()
@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+'''
+Test the packed timestamp coder
+'''
+
+import random
+from datetime import datetime, timedelta
+from keepass import coder
+
+def random_times(count):
+    start = datetime(1990, 1, 1)
+    return [start + timedelta(seconds=random.randrange(2**31)) for ind in range(count)]
+
+def test_lazy():
+    when = datetime(2010, 10, 25, 19, 19, 52)
+    packed = coder.DatetimeCoder.encode(when)
+    lazy = coder.DatetimeCoder.decode(packed)
+    assert lazy._datetime is None
+    assert lazy == when and when == lazy and hash(lazy) == hash(when)
+    assert lazy < datetime(2011, 1, 1) and datetime(2011, 1, 1) > lazy
+    assert (lazy.year, str(lazy)) == (2010, '2010-10-25 19:19:52')
+    assert lazy - when == timedelta(0) and when - lazy == timedelta(0)
+    assert coder.DatetimeCoder.encode(lazy) is packed
+
+def test_order():
+    times = random_times(500)
+    packed = [coder.DatetimeCoder.decode(coder.DatetimeCoder.encode(t)) for t in times]
+    ordered = sorted(packed)
+    assert all(p._datetime is None for p in packed)
+    assert ordered == sorted(times)
+    buf = ''.join(p.packed for p in packed)
+    assert coder.unpack_datetimes(buf) == times
+    assert coder.packed_keys(buf) == [p.key() for p in packed]
+
+if '__main__' == __name__:
+    test_lazy()
+    test_order()
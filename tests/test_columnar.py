@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+'''
+Test the columnar entry store
+'''
+
+import os, tempfile
+from keepass import kpdb, columnar, infoblock
+from keepass.coder import FIELD_HEADER
+
+testkdb = os.path.join(os.path.dirname(__file__), 'test.kdb')
+
+def test_read():
+    db = kpdb.Database(testkdb, passphrase='test')
+    col = kpdb.Database(testkdb, passphrase='test', columnar=True)
+    assert col.entries == [] and len(col.columns) == 4
+    assert [r.asdict() for r in col.columns] == [e.asdict() for e in db.entries]
+    assert col.columns.column('groupid') == [e.groupid for e in db.entries]
+    times = col.columns.column('last_mod_time')
+    assert times == [e.last_mod_time for e in db.entries]
+    assert [times[row] for row in col.columns.order('last_mod_time')] == sorted(times)
+    assert col.columns[-1].notes == 'KPX_GROUP_TREE_STATE'
+    assert col.encode_payload() == db.encode_payload()
+    assert [e.encode() for e in col.columns.to_entries()] == [e.encode() for e in db.entries]
+
+def test_append_and_write():
+    db = kpdb.Database(testkdb, passphrase='test')
+    cols = columnar.EntryColumns()
+    for ent in db.entries:
+        cols.append(ent)
+    assert [r.title for r in cols] == [e.title for e in db.entries]
+
+    col = kpdb.Database(testkdb, passphrase='test', columnar=True)
+    fd, filename = tempfile.mkstemp(suffix='.kdb')
+    os.close(fd)
+    try:
+        col.write(filename)
+        db2 = kpdb.Database(filename, passphrase='test')
+    finally:
+        os.remove(filename)
+    assert [e.encode() for e in db2.entries] == [e.encode() for e in db.entries]
+
+    col.columns_to_entries()
+    assert col.columns is None and len(col.entries) == 4
+
+def test_unusual_records():
+    # unknown fields and fields out of order survive a columnar round trip
+    db = kpdb.Database(testkdb, passphrase='test')
+    raw = db.entries[0].encode()
+    unknown = FIELD_HEADER.pack(0x20, 3) + 'abc' + raw
+    fields = [raw[index-6:index+siz] for typ, siz, index in infoblock.walk(raw)]
+    moved = ''.join(fields[4:5] + fields[:4] + fields[5:])    # title first
+    db.entries[0] = infoblock.EntryInfo(unknown)
+    db.entries[1] = infoblock.EntryInfo(moved)
+    assert db.entries[0]._extra and db.entries[1]._order
+
+    fd, filename = tempfile.mkstemp(suffix='.kdb')
+    os.close(fd)
+    try:
+        db.write(filename)
+        col = kpdb.Database(filename, passphrase='test', columnar=True)
+        assert col.columns[1].title == 'My Email Account'
+        col.write(filename)
+        db2 = kpdb.Database(filename, passphrase='test')
+    finally:
+        os.remove(filename)
+    assert [e.encode() for e in db2.entries] == [e.encode() for e in db.entries]
+    assert db2.entries[0].encode() == unknown
+
+    cols = columnar.EntryColumns()
+    for ent in db.entries:
+        cols.append(ent)
+    assert [e.encode() for e in cols.to_entries()] == [e.encode() for e in db.entries]
+
+def test_entry_apis():
+    col = kpdb.Database(testkdb, passphrase='test', columnar=True)
+    calls = [lambda: col.get('My Email Account'),
+             lambda: col.find(title='My Email Account'),
+             lambda: col.search('email'),
+             lambda: col.match_url('mail.example.com'),
+             lambda: col.resolve('Internet'),
+             lambda: col.group_entries(col.groups[0].groupid),
+             lambda: col.dump_entries('%(title)s'),
+             lambda: col.remove_group(col.groups[0])]
+    for call in calls:
+        try:
+            call()
+        except ValueError:
+            continue
+        assert False, 'entry API worked on columns'
+    assert len(col.groups) == 3 and len(col.columns) == 4
+
+    col.columns_to_entries()
+    assert col.get('My Email Account') is col.entries[0]
+    col.remove_group(col.groups[0])
+    assert len(col.entries) == 1
+
+if '__main__' == __name__:
+    test_read()
+    test_append_and_write()
+    test_unusual_records()
+    test_entry_apis()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+'''
+Test importing entries in bulk
+'''
+
+import os, tempfile
+from StringIO import StringIO
+from keepass import kpdb, cli
+
+testkdb = os.path.join(os.path.dirname(__file__), 'test.kdb')
+
+csvdata = '''path,title,username,password,url,imageid
+Servers/Prod,db01,root,one,ssh://db01,3
+Servers/Prod,db02,root,two,,
+/Servers/Test/,db01,root,three,,
+Internet,My Email Account,nobody@example.com,changed,,
+'''
+
+def test_import():
+    db = kpdb.Database(testkdb, passphrase='test')
+    count = len(db.entries)
+    records = list(cli.read_records(StringIO(csvdata), 'csv'))
+    assert db.import_entries(records) == (3, 1)
+    assert len(db.entries) == count + 3
+    db01 = db.resolve('Servers/Prod/db01')[0]
+    assert (db01.password, db01.url, db01.imageid) == ('one', 'ssh://db01', 3)
+    assert db.resolve('Internet/My Email Account')[0].password == 'changed'
+
+    # importing again updates, appending adds
+    records[0]['password'] = 'new'
+    assert db.import_entries(records) == (0, 4)
+    assert db01.password == 'new'
+    assert db.import_entries(records[:2], append=True) == (2, 0)
+    assert len(db.resolve('Servers/Prod/db01')) == 2
+
+def test_jsonl():
+    db = kpdb.Database(testkdb, passphrase='test')
+    lines = ['{"path": ["A", "B"], "title": "t", "username": "u", "password": "p"}',
+             '',
+             '{"path": "A/B", "title": "t", "username": "u", "password": "q"}']
+    records = cli.read_records(StringIO('\n'.join(lines)), 'jsonl')
+    assert db.import_entries(records) == (1, 0)
+    entry, = db.resolve('/A/B/t')
+    assert entry.password == 'q' and isinstance(entry.title, str)
+
+def test_keys():
+    db = kpdb.Database(testkdb, passphrase='test')
+    count = len(db.entries)
+
+    # a missing title or username is keyed as its default
+    assert db.import_entries([{'path': 'A', 'username': 'u'}]) == (1, 0)
+    assert db.import_entries([{'path': 'A', 'username': 'u', 'password': 'p'}]) == (0, 1)
+    entry, = db.resolve('A/Unknown')
+    assert (entry.username, entry.password) == ('u', 'p')
+    assert db.import_entries([{'path': 'A', 'title': 'Unknown'}]*2) == (1, 0)
+    assert len(db.entries) == count + 2
+
+    # a known UUID updates its entry, even when appending
+    uuid = db.entries[0].uuid
+    record = {'path': 'Internet', 'uuid': uuid, 'title': 'renamed'}
+    assert db.import_entries([record], append=True) == (0, 1)
+    assert db.import_entries([record]) == (0, 1)
+    found, = db.find(uuid=uuid)
+    assert found is db.entries[0] and found.title == 'renamed'
+    fresh = 'f'*32
+    assert db.import_entries([{'path': 'A', 'uuid': fresh, 'password': 'a'},
+                              {'path': 'A', 'uuid': fresh, 'password': 'b'}],
+                             append=True) == (1, 0)
+    found, = db.find(uuid=fresh)
+    assert found.password == 'b'
+    assert len(db.entries) == count + 3
+
+def test_command():
+    fd, csvfile = tempfile.mkstemp(suffix='.csv')
+    os.write(fd, csvdata)
+    os.close(fd)
+    fd, outfile = tempfile.mkstemp(suffix='.kdb')
+    os.close(fd)
+    try:
+        cli.Cli(['open', '-m', 'test', testkdb, 'import', csvfile,
+                 'save', '-m', 'test', outfile])()
+        db = kpdb.Database(outfile, passphrase='test')
+    finally:
+        os.remove(csvfile)
+        os.remove(outfile)
+    assert [e.password for e in db.glob('Servers/*/db01')] == ['one', 'three']
+
+if '__main__' == __name__:
+    test_import()
+    test_jsonl()
+    test_keys()
+    test_command()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+'''
+Test the maintained entry indexes
+'''
+
+import os
+from keepass import kpdb, infoblock
+
+testkdb = os.path.join(os.path.dirname(__file__), 'test.kdb')
+
+def test_lookup():
+    db = kpdb.Database(testkdb, passphrase='test')
+    assert len(db.find(title='Meta-Info')) == 2
+    assert db.get('My Email Account') is db.entries[0]
+    assert db.find(title='My Email Account', groupid=db.groups[2].groupid) == [db.entries[1]]
+    assert db.get('nothing') is None
+
+def test_maintained():
+    db = kpdb.Database(testkdb, passphrase='test', lazy=True)
+    ent = db.entries[0]
+    ent.title = 'Renamed'
+    assert db.get('Renamed') is ent
+    assert len(db.find(title='My Email Account')) == 1
+
+    new = infoblock.EntryInfo()
+    new.title = 'New'
+    new.url = 'https://example.com'
+    db.append_entry(new)
+    assert db.find(url='https://example.com') == [new]
+
+    db.remove_entry(ent)
+    assert db.get('Renamed') is None
+    assert ent not in db.entries and len(db.entries) == 4
+    ent.title = 'Again'         # no longer indexed
+    assert db.get('Again') is None
+
+    assert db.entries[0] is new  # took the place of the removed entry
+    db.entries = db.entries[1:]  # replaced behind the index's back
+    assert db.find(title='New') == []
+
+def test_groups():
+    db = kpdb.Database(testkdb, passphrase='test')
+    internet, email, backup = db.groups
+    assert db.group('groupid', backup.groupid) is backup
+    assert db.group('imageid', 19) is email
+    assert db.entry_group(db.entries[1]) is backup
+    assert db.group_entries(internet.groupid) == [db.entries[0]] + db.entries[2:]
+    db.entries[1].groupid = email.groupid
+    assert db.group_entries(email.groupid) == [db.entries[1]]
+    db.remove_group(internet)
+    assert db.groups == [email, backup]
+    assert db.group_index().position == {id(email): 0, id(backup): 1}
+    assert db.group('groupid', internet.groupid) is None
+    assert db.group('groupid', backup.groupid) is backup
+
+def decoded(entry, name):
+    'Return True if the field of the lazy entry is decoded'
+    try:
+        getattr(infoblock.EntryInfo, name).__get__(entry)
+    except AttributeError:
+        return False
+    return True
+
+def test_lazy():
+    db = kpdb.Database(testkdb, passphrase='test', lazy=True)
+    entry = db.get('My Email Account')
+    assert entry is db.entries[0]
+    for other in db.entries:
+        assert decoded(other, 'title')
+        assert not decoded(other, 'uuid') and not decoded(other, 'username')
+        continue
+
+def test_bucket_order():
+    db = kpdb.Database(testkdb, passphrase='test')
+    internet = db.groups[0]
+    entries = db.group_entries(internet.groupid)
+    first = entries[0]
+    first.groupid = db.groups[1].groupid
+    first.groupid = internet.groupid  # back, but last into the bucket
+    assert db.group_entries(internet.groupid) == entries
+
+if '__main__' == __name__:
+    test_lookup()
+    test_maintained()
+    test_groups()
+    test_lazy()
+    test_bucket_order()
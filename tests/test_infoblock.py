@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+'''
+Test the slotted GroupInfo and EntryInfo records
+'''
+
+import struct
+from keepass import infoblock as ib
+
+def field(typ, data):
+    return struct.pack('<H I', typ, len(data)) + data
+
+def test_canonical():
+    ent = ib.EntryInfo()
+    assert not hasattr(ent, '__dict__')
+    assert ent._order is None and ent._extra is None
+    ent.title = 'title'
+    assert str(ib.EntryInfo(ent.encode())) == str(ent)
+    assert len(ib.EntryInfo(ent.encode())) == len(ent.encode())
+
+def test_order_and_unknown():
+    string = field(0x2, 'name\0') + field(0x1, '\x01\x00\x00\x00') + \
+        field(0x42, 'mystery') + field(0xFFFF, '')
+    grp = ib.GroupInfo(string)
+    assert (grp.groupid, grp.group_name) == (1, 'name')
+    assert grp._order == (0x2, 0x1, 0x42, 0xFFFF)
+    assert grp._extra == {0x42: 'mystery'}
+    assert len(grp) == len(string)
+    encoded = grp.encode()
+    assert encoded.startswith(string[:-6])
+    again = ib.GroupInfo(encoded)
+    assert again._extra == grp._extra
+    assert again.encode() == encoded
+
+def test_codecs():
+    for cls in [ib.GroupInfo, ib.EntryInfo]:
+        assert sorted(cls._codecs) == sorted(typ for typ in cls.format if typ != 0xFFFF)
+    ent = ib.EntryInfo()
+    ent.title = 'title'
+    string = ent.encode()
+    for buf in [string, bytearray('pad' + string), memoryview('pad' + string)]:
+        got = ib.EntryInfo.__new__(ib.EntryInfo)
+        object.__setattr__(got, '_listeners', ())
+        offset = 0 if buf is string else 3
+        assert got.decode(buf, offset) == offset + len(string)
+        assert got.encode() == string
+
+def test_constructor():
+    ent = ib.EntryInfo(title='title', groupid=7)
+    assert (ent.title, ent.groupid, ent.url) == ('title', 7, '')
+    again = ib.EntryInfo(ent.encode())
+    assert str(again) == str(ent)
+    try:
+        ib.GroupInfo(group_name='name', bogus=1)
+    except TypeError:
+        pass
+    else:
+        assert False, 'unknown field accepted'
+
+def test_make_entries():
+    items = [dict(title='entry %d'%ind, groupid=1) for ind in range(100)]
+    items[0]['uuid'] = 'ab'*16
+    ents = ib.make_entries(items)
+    assert [e.title for e in ents] == [item['title'] for item in items]
+    assert ents[0].uuid == 'ab'*16
+    assert len(set(e.uuid for e in ents)) == 100
+    assert len(set(e.creation_time for e in ents)) == 1
+    assert ents[-1].last_acc_time == ents[0].creation_time
+
+if '__main__' == __name__:
+    test_canonical()
+    test_order_and_unknown()
+    test_codecs()
+    test_constructor()
+    test_make_entries()
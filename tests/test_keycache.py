@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+'''
+Test the cache of transformed master keys
+'''
+
+import os
+from keepass import kpdb, keycache
+
+testkdb = os.path.join(os.path.dirname(__file__), 'test.kdb')
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0
+    def __call__(self):
+        return self.now
+
+def test_lru():
+    kc = keycache.KeyCache(maxsize=2, ttl=None)
+    kc.put('a', 'seed', 10, 'A')
+    kc.put('b', 'seed', 10, 'B')
+    assert kc.get('a', 'seed', 10) == 'A' # a is now most recent
+    kc.put('c', 'seed', 10, 'C')
+    assert kc.get('b', 'seed', 10) is None
+    assert kc.get('a', 'seed', 10) == 'A'
+    assert kc.get('c', 'seed', 10) == 'C'
+    assert kc.get('a', 'seed', 11) is None
+    assert (kc.hits, kc.misses) == (3, 2)
+
+def test_ttl_and_purge():
+    clock = FakeClock()
+    kc = keycache.KeyCache(ttl=10, clock=clock)
+    kc.put('a', 'seed1', 10, 'A')
+    kc.put('b', 'seed2', 10, 'B')
+    clock.now = 5
+    assert kc.get('a', 'seed1', 10) == 'A'
+    assert kc.purge('seed2') == 1
+    assert kc.get('b', 'seed2', 10) is None
+    clock.now = 10
+    assert kc.get('a', 'seed1', 10) is None
+    assert len(kc) == 0
+
+def test_database():
+    kc = keycache.KeyCache()
+    db1 = kpdb.Database(testkdb, passphrase='test', keycache=kc)
+    db2 = kpdb.Database(testkdb, passphrase='test', keycache=kc)
+    assert (kc.hits, kc.misses) == (1, 1)
+    assert db1.finalkey == db2.finalkey
+    assert kc.purge() == 1
+
+if '__main__' == __name__:
+    test_lru()
+    test_ttl_and_purge()
+    test_database()
@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+'''
+Test background derivation of keys for regenerated seeds
+'''
+
+import os, time, tempfile
+from keepass import kpdb, keypool, transform
+
+testkdb = os.path.join(os.path.dirname(__file__), 'test.kdb')
+
+def wait_ready(pool, timeout=10):
+    start = time.time()
+    while not pool.ready() and time.time() - start < timeout:
+        time.sleep(0.01)
+    return pool.ready()
+
+def test_pool():
+    key = os.urandom(32)
+    pool = keypool.KeyPool(key, 100)
+    assert wait_ready(pool)
+    assert pool.take(key, 200) is None  # wrong rounds retargets
+    assert wait_ready(pool)
+    seed, tkey = pool.take(key, 200)
+    assert tkey == transform.TransformEngine()(key, seed, 200)
+    pool.stop()
+
+def test_regenerate():
+    db = kpdb.Database(testkdb, passphrase='test', prederive=True)
+    assert wait_ready(db.keypool)
+    fd, filename = tempfile.mkstemp(suffix='.kdb')
+    os.close(fd)
+    try:
+        db.write(filename, regenerate=True)
+        db.write(filename, regenerate=True) # pool is empty again
+        db2 = kpdb.Database(filename, passphrase='test')
+    finally:
+        db.stop_keypool()
+        os.remove(filename)
+    assert db2.header.transform_seed == db.header.transform_seed
+    assert [e.title for e in db2.entries] == [e.title for e in db.entries]
+
+if '__main__' == __name__:
+    test_pool()
+    test_regenerate()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+'''
+Test merging databases
+'''
+
+import os, tempfile
+from datetime import timedelta
+from keepass import kpdb, merge
+from keepass.infoblock import GroupInfo
+
+testkdb = os.path.join(os.path.dirname(__file__), 'test.kdb')
+
+def databases():
+    'Return two copies of the test file, each changed in its own way'
+    ours = kpdb.Database(testkdb, passphrase='test')
+    theirs = kpdb.Database(testkdb, passphrase='test')
+    for db, name in [(ours, 'ours'), (theirs, 'theirs')]:
+        entry = db.resolve('Internet/My Email Account')[0]
+        entry.password = name
+        entry.last_mod_time += timedelta(days=name == 'theirs' and 2 or 1)
+        continue
+
+    # a group of theirs with the ID of another group of ours
+    taken = ours.mkdir('Only/Ours').groupid
+    theirs.append_group(GroupInfo(groupid=taken, group_name='Theirs', imageid=1),
+                        theirs.mkdir('Only'))
+    theirs.add_entry('Only/Theirs', 'new', 'me', 'secret')
+    return ours, theirs
+
+def test_merge():
+    ours, theirs = databases()
+    count = len(ours.entries)
+    db, report = merge.merge([ours, theirs])
+    assert db is ours
+    assert report.counts() == dict(added=1, updated=1, kept=0, same=1, skipped=2)
+    assert len(db.entries) == count + 1
+    assert db.resolve('Internet/My Email Account')[0].password == 'theirs'
+
+    # colliding group IDs are remapped, matching paths are shared
+    assert [g.group_name for g in db.groups].count('Only') == 1
+    new = db.resolve('Only/Theirs/new')[0]
+    group = db.entry_group(new)
+    assert group.group_name == 'Theirs'
+    taken = db.resolve('Only/Ours')[0].groupid
+    assert group.groupid != taken
+    assert (testkdb, taken, group.groupid, ['Only', 'Theirs']) in report.groups
+
+    fd, filename = tempfile.mkstemp(suffix='.kdb')
+    os.close(fd)
+    try:
+        db.write(filename)
+        again = kpdb.Database(filename, passphrase='test')
+    finally:
+        os.remove(filename)
+    assert sorted(e.uuid for e in again.entries) == sorted(e.uuid for e in db.entries)
+    assert again.resolve('Only/Theirs/new')[0].groupid == group.groupid
+
+def test_policy():
+    ours, theirs = databases()
+    db, report = merge.merge([ours, theirs], merge.keep_ours)
+    assert report.counts()['kept'] == 1
+    assert db.resolve('Internet/My Email Account')[0].password == 'ours'
+
+    # merging the result again changes nothing
+    db, report = merge.merge([db, theirs], merge.keep_ours)
+    assert report.counts() == dict(added=0, updated=0, kept=1, same=2, skipped=2)
+
+if '__main__' == __name__:
+    test_merge()
+    test_policy()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+'''
+Test opening many files in worker processes
+'''
+
+import os, shutil, tempfile
+from keepass import kpdb
+
+testkdb = os.path.join(os.path.dirname(__file__), 'test.kdb')
+
+def boom(key, seed, rounds):
+    raise AssertionError, 'key transformed again'
+
+def test_open_many():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        specs = []
+        for ind in range(3):
+            filename = os.path.join(tmpdir, 'vault%d.kdb' % ind)
+            shutil.copy(testkdb, filename)
+            specs.append(filename)
+            continue
+        specs.append(dict(filename=testkdb, passphrase='wrong'))
+        specs.append(os.path.join(tmpdir, 'missing.kdb'))
+
+        results = dict((filename, (db, error)) for filename, db, error
+                       in kpdb.open_many(specs, workers=2, passphrase='test', lazy=True))
+        assert sorted(results) == sorted([testkdb] + specs[:3] + specs[4:])
+        assert isinstance(results[testkdb][1], ValueError)
+        assert isinstance(results[specs[-1]][1], IOError)
+
+        expected = kpdb.Database(testkdb, passphrase='test')
+        for filename in specs[:3]:
+            db, error = results[filename]
+            assert error is None and db.filename == filename and db.lazy
+            assert [e.uuid for e in db.entries] == [e.uuid for e in expected.entries]
+
+            # the transformed key came back with the database
+            db.engine = boom
+            db.entries[0].title = 'changed'
+            db.write()
+            again = kpdb.Database(filename, passphrase='test')
+            assert again.entries[0].title == 'changed'
+            continue
+    finally:
+        shutil.rmtree(tmpdir)
+
+if '__main__' == __name__:
+    test_open_many()
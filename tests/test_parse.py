@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+'''
+Test offset based parsing of the decrypted payload
+'''
+
+import os
+from keepass import kpdb, infoblock
+
+testkdb = os.path.join(os.path.dirname(__file__), 'test.kdb')
+
+def test_decode_offset():
+    ent = infoblock.EntryInfo()
+    ent.title = 'second'
+    string = infoblock.EntryInfo().encode() + ent.encode()
+    first = infoblock.EntryInfo(string)
+    second = infoblock.EntryInfo()
+    end = second.decode(string, len(first))
+    assert end == len(string)
+    assert second.title == 'second'
+
+def test_read():
+    db = kpdb.Database(testkdb, passphrase='test')
+    assert [g.group_name for g in db.groups] == ['Internet', 'eMail', 'Backup']
+    assert [e.title for e in db.entries] == ['My Email Account']*2 + ['Meta-Info']*2
+    assert db.entries[0].binary_desc == 'DbFormat.txt'
+    assert db.encode_payload() == ''.join(r.encode() for r in db.groups + db.entries)
+
+def decoded(entry, name):
+    'Return True if the field of the lazy entry is decoded'
+    try:
+        getattr(infoblock.EntryInfo, name).__get__(entry)
+    except AttributeError:
+        return False
+    return True
+
+def test_lazy():
+    eager = kpdb.Database(testkdb, passphrase='test')
+    lazy = kpdb.Database(testkdb, passphrase='test', lazy=True)
+    ent = lazy.entries[0]
+    assert ent.title == 'My Email Account'
+    assert decoded(ent, 'title') and not decoded(ent, 'notes')
+    assert [e.asdict() for e in lazy.entries] == [e.asdict() for e in eager.entries]
+    assert lazy.encode_payload() == eager.encode_payload()
+    ent.materialize()
+    assert ent._data is None
+    assert str(ent).split(':',1)[1] == str(eager.entries[0]).split(':',1)[1]
+
+def test_mmap():
+    db = kpdb.Database(testkdb, passphrase='test')
+    mapped = kpdb.Database(testkdb, passphrase='test', use_mmap=True)
+    assert str(mapped.header) == str(db.header)
+    assert mapped.encode_payload() == db.encode_payload()
+
+if '__main__' == __name__:
+    test_decode_offset()
+    test_read()
+    test_lazy()
+    test_mmap()
@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+'''
+Test calibrating transform rounds and regenerating seeds on write
+'''
+
+import os, tempfile
+from keepass import kpdb, transform
+
+testkdb = os.path.join(os.path.dirname(__file__), 'test.kdb')
+
+def test_calibrate():
+    rounds = transform.calibrate(0.05, sample=0.01)
+    assert rounds > 0
+
+def test_regenerate():
+    db = kpdb.Database(testkdb, passphrase='test')
+    old = db.header.encode()
+    fd, filename = tempfile.mkstemp(suffix='.kdb')
+    os.close(fd)
+    try:
+        db.write(filename, regenerate=True, rounds=1234)
+        db2 = kpdb.Database(filename, passphrase='test')
+    finally:
+        os.remove(filename)
+    assert db2.header.transform_rounds == 1234
+    for name in ['final_master_seed', 'encryption_iv', 'transform_seed']:
+        assert getattr(db2.header, name) != getattr(kpdb.DBHDR(old), name)
+    assert [e.title for e in db2.entries] == [e.title for e in db.entries]
+
+if '__main__' == __name__:
+    test_calibrate()
+    test_regenerate()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+'''
+Test the full text search index
+'''
+
+import os, sys
+from StringIO import StringIO
+from keepass import kpdb, cli
+
+testkdb = os.path.join(os.path.dirname(__file__), 'test.kdb')
+
+def make_db():
+    db = kpdb.Database(testkdb, passphrase='test', index_search=True)
+    db.import_entries([
+            dict(path='Servers', title='db01 primary', username='postgres', password='hunter2',
+                 url='ssh://db01.example.com', notes='Primary database server'),
+            dict(path='Servers', title='db02 replica', username='postgres', password='hunter2',
+                 url='ssh://db02.example.com', notes='Replica of db01'),
+            dict(path='Web', title='Intranet', username='admin', password='database',
+                 url='https://intranet.example.com'),
+            ])
+    return db
+
+def titles(found):
+    return [e.title for e in found]
+
+def test_search():
+    db = make_db()
+    assert db._search is db.search_index()
+    assert titles(db.search('db01')) == ['db01 primary', 'db02 replica']
+    assert titles(db.search('db01 replica')) == ['db02 replica']
+    assert titles(db.search('DB0* postgres')) == ['db02 replica', 'db01 primary']
+    assert titles(db.search('Prim* postgres', limit=1)) == ['db01 primary']
+    assert titles(db.search('datab*')) == ['db01 primary']       # not the password
+    assert titles(db.search('hunter2')) == []
+    assert titles(db.search('example.com ssh')) == ['db01 primary', 'db02 replica']
+    assert titles(db.search('e*')) == titles(db.search('example'))
+    assert db.search('') == [] and db.search('*') == []
+
+def test_maintained():
+    db = make_db()
+    index = db.search_index()
+    intranet = db.search('intranet')[0]
+    intranet.notes = 'moved to the cloud'
+    assert db.search('cloud') == [intranet]
+    intranet.title = 'Portal'
+    assert db.search('intranet') == [intranet]     # from the URL
+    intranet.url = ''
+    assert db.search('intranet') == []
+    db.remove_entry(intranet)
+    assert db.search('cloud') == []
+    db.remove_group(db.resolve('Servers')[0])
+    assert db.search('postgres') == []
+    assert db.search_index() is index
+    assert 'postgres' not in index.postings and '^^p' not in index.grams
+
+def test_command():
+    db = make_db()
+    obj = cli.Cli(['search', '-n', '1', 'replica'])
+    obj.db = db
+    stdout, sys.stdout = sys.stdout, StringIO()
+    try:
+        obj()
+        printed = sys.stdout.getvalue()
+    finally:
+        sys.stdout = stdout
+    assert printed.split()[1:] == ['Servers/db02', 'replica:', 'postgres', 'ssh://db02.example.com']
+
+if '__main__' == __name__:
+    test_search()
+    test_maintained()
+    test_command()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+'''
+Test the streaming reader and writer
+'''
+
+import os, tempfile
+from keepass import kpdb
+
+testkdb = os.path.join(os.path.dirname(__file__), 'test.kdb')
+
+def test_stream():
+    db = kpdb.Database(testkdb, passphrase='test')
+    want = [str(r) for r in db.groups + db.entries]
+    for chunksize in [16, 100, 4096, 1<<20]:
+        stream = kpdb.Database(passphrase='test')
+        got = [str(r) for r in stream.iter_records(testkdb, chunksize)]
+        assert got == want
+    titles = [e.title for e in kpdb.iter_entries(testkdb, passphrase='test')]
+    assert titles == [e.title for e in db.entries]
+
+def test_wrong_key():
+    try:
+        list(kpdb.iter_entries(testkdb, passphrase='wrong'))
+    except ValueError:
+        return
+    assert False, 'wrong key not detected'
+
+def test_write():
+    db = kpdb.Database(testkdb, passphrase='test')
+    payload = db.encode_payload()
+    fd, filename = tempfile.mkstemp(suffix='.kdb')
+    os.close(fd)
+    try:
+        for chunksize in [1, 100, 1<<20]:
+            db.write(filename, chunksize=chunksize)
+            written = open(filename,'rb').read()
+            assert written[kpdb.DBHDR.length:] == \
+                db.encrypt_payload(payload, db.finalkey, 'Rijndael', db.header.encryption_iv)
+            db2 = kpdb.Database(filename, passphrase='test')
+            assert [e.password for e in db2.entries] == [e.password for e in db.entries]
+            assert db2.header.contents_hash == db.header.contents_hash
+    finally:
+        os.remove(filename)
+
+def test_failed_write():
+    db = kpdb.Database(testkdb, passphrase='test')
+    fd, filename = tempfile.mkstemp(suffix='.kdb')
+    os.close(fd)
+    try:
+        db.write(filename)
+        db.entries[0].binary_data = 'x'*300000
+        try:
+            db.write(filename)
+        except Exception:
+            pass
+        else:
+            assert False, 'oversized field written'
+        db2 = kpdb.Database(filename, passphrase='test')
+        assert [e.uuid for e in db2.entries] == [e.uuid for e in db.entries]
+        assert not [name for name in os.listdir(os.path.dirname(filename))
+                    if name.startswith('.' + os.path.basename(filename))]
+    finally:
+        os.remove(filename)
+
+if '__main__' == __name__:
+    test_stream()
+    test_wrong_key()
+    test_write()
+    test_failed_write()
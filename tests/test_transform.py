@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+'''
+Test the key transformation engines
+'''
+
+import os, threading
+from Crypto.Cipher import AES
+from keepass import kpdb, transform
+
+testkdb = os.path.join(os.path.dirname(__file__), 'test.kdb')
+
+key = ''.join(chr(i) for i in range(32))
+seed = ''.join(chr(255-i) for i in range(32))
+
+def reference(key, seed, rounds):
+    cipher = AES.new(seed, AES.MODE_ECB)
+    for i in range(rounds):
+        key = cipher.encrypt(key)
+    return key
+
+def test_identical():
+    for rounds in [0, 1, 7, 1000]:
+        want = reference(key, seed, rounds)
+        assert transform.TransformEngine(chunk=3)(key, seed, rounds) == want
+        assert transform.SplitTransformEngine(chunk=3)(key, seed, rounds) == want
+
+def test_progress():
+    seen = []
+    engine = transform.SplitTransformEngine(progress=lambda d,t: seen.append((d,t)),
+                                            chunk=100)
+    engine(key, seed, 1000)
+    assert seen[-1] == (1000, 1000)
+    assert seen == sorted(seen)
+
+def test_cancel():
+    for cls in [transform.TransformEngine, transform.SplitTransformEngine]:
+        stop = threading.Event()
+        stop.set()
+        try:
+            cls(cancel=stop, chunk=10)(key, seed, 10**7)
+        except transform.TransformCancelled:
+            continue
+        assert False, 'transform was not cancelled'
+
+def test_error():
+    # a worker's exception reaches the caller instead of the key coming back untransformed
+    key = os.urandom(32)
+    for cls in [transform.TransformEngine, transform.SplitTransformEngine]:
+        try:
+            cls()(key, 'short-seed', 10)
+        except ValueError:
+            pass
+        else:
+            assert False, '%s accepted a bad seed' % cls.__name__
+
+def test_database():
+    db = kpdb.Database(testkdb, passphrase='test',
+                       engine=transform.SplitTransformEngine())
+    assert len(db.entries) == 4
+
+if '__main__' == __name__:
+    test_identical()
+    test_progress()
+    test_cancel()
+    test_error()
+    test_database()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+'''
+Test the group hierarchy kept with the database
+'''
+
+import os, tempfile
+from keepass import kpdb, hier
+
+testkdb = os.path.join(os.path.dirname(__file__), 'test.kdb')
+
+def levels(db):
+    return [(g.group_name, g.level) for g in db.groups]
+
+def test_build():
+    db = kpdb.Database(testkdb, passphrase='test')
+    top = db.hierarchy()
+    assert top is db.hierarchy()
+    assert [n.name() for n in top.nodes] == [g.group_name for g in db.groups]
+    assert sum(len(n.entries) for n in hier.iter_nodes(top)) == len(db.entries)
+    db.update(top)
+    assert db.hierarchy() is top
+
+def test_maintained():
+    db = kpdb.Database(testkdb, passphrase='test')
+    tree = db.tree()
+    mail = db.mkdir('Internet/Mail')
+    assert db.mkdir('/Internet/Mail/') is mail
+    assert tree.node(mail).path() == ['Internet', 'Mail']
+    assert db.tree() is tree
+
+    db.add_entry('Internet/Mail', 'title', 'me', 'secret')
+    entry = db.get('title')
+    assert tree.node(mail).entries == [entry]
+
+    # moving an entry by its groupid moves it in the tree
+    backup = db.group('group_name', 'Backup')
+    entry.groupid = backup.groupid
+    assert entry in tree.node(backup).entries and not tree.node(mail).entries
+
+    # levels and order are fixed up for writing
+    db.move_group(db.group('group_name', 'eMail'), mail)
+    payload = db.encode_payload()
+    assert levels(db) == [('Internet', 0), ('Mail', 1), ('eMail', 2), ('Backup', 0)]
+    assert db.tree() is tree
+
+    fd, filename = tempfile.mkstemp(suffix='.kdb')
+    os.close(fd)
+    try:
+        db.write(filename)
+        db2 = kpdb.Database(filename, passphrase='test')
+    finally:
+        os.remove(filename)
+    assert levels(db2) == levels(db)
+    assert db2.tree().find('Internet/Mail/eMail') is not None
+
+    # removing a group takes what is below it
+    internet = db.group('group_name', 'Internet')
+    kept = [e for e in db.entries if e.groupid != internet.groupid]
+    db.remove_group(internet)
+    assert levels(db) == [('Backup', 0)]
+    assert sorted(db.entries) == sorted(kept) and entry in kept
+    assert db.tree() is tree
+
+def test_move_below_itself():
+    db = kpdb.Database(testkdb, passphrase='test')
+    inner = db.mkdir('Internet/Inner')
+    try:
+        db.move_group(db.group('group_name', 'Internet'), inner)
+    except ValueError:
+        return
+    assert False, 'group moved below itself'
+
+def test_paths():
+    db = kpdb.Database(testkdb, passphrase='test')
+    names = lambda found: sorted(getattr(r, 'title', None) or r.group_name for r in found)
+    for host in ['db01', 'db02', 'web01']:
+        for env in ['Prod', 'Test']:
+            db.add_entry('Servers/%s' % env, host, 'root', 'secret')
+            continue
+        continue
+    db.add_entry('Servers/Prod/db01', 'console', 'root', 'secret')
+
+    assert names(db.resolve('/Servers/Prod/db01')) == ['db01', 'db01']
+    assert names(db.resolve('Servers/Prod/nothing')) == []
+    assert names(db.glob('/Servers/*/db*')) == ['db01', 'db01', 'db01', 'db02', 'db02']
+    assert names(db.glob('/Servers/P*')) == ['Prod']
+    assert names(db.glob('/*/*/db01/*')) == ['console']
+
+    # renames and moves are followed
+    prod = db.resolve('Servers/Prod')[0]
+    prod.group_name = 'Live'
+    assert db.resolve('Servers/Prod') == [] and db.resolve('Servers/Live') == [prod]
+    entry = db.glob('Servers/Live/web01')[0]
+    entry.title = 'web02'
+    assert db.resolve('Servers/Live/web02') == [entry]
+    entry.groupid = db.resolve('Servers/Test')[0].groupid
+    assert names(db.resolve('Servers/Test/web02')) == ['web02']
+    assert db.tree().find('Servers/Live/db01').path() == ['Servers', 'Live', 'db01']
+
+def test_remove_in_place():
+    # nodes hold their entries and children by id, removal keeps the order
+    node = hier.Node()
+    db = kpdb.Database(testkdb, passphrase='test')
+    entries = db.entries
+    for entry in entries:
+        node.add_entry(entry)
+        continue
+    node.remove_entry(entries[1])
+    node.remove_entry(entries[1])   # again, not there
+    assert node.entries == [entries[0]] + entries[2:]
+    assert node.titles['My Email Account'].values() == [entries[0]]
+    node.remove_entry(entries[0])
+    assert 'My Email Account' not in node.titles
+
+    first, second, third = [node.add_node(hier.Node(group)) for group in db.groups]
+    node.remove_node(first)
+    assert node.nodes == [second, third] and first.parent is None
+    assert node.child('Internet') is None and node.child('Backup') is third
+
+if '__main__' == __name__:
+    test_build()
+    test_maintained()
+    test_move_below_itself()
+    test_paths()
+    test_remove_in_place()
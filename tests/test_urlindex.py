@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+'''
+Test the URL index
+'''
+
+import os
+from keepass import kpdb, urlindex
+
+testkdb = os.path.join(os.path.dirname(__file__), 'test.kdb')
+
+def test_parse():
+    assert urlindex.parse_url('https://WWW.Example.com./login') == \
+        ('https', ['www', 'example', 'com'], 443, '/login')
+    assert urlindex.parse_url('example.com:8080') == ('', ['example', 'com'], 8080, '/')
+    assert urlindex.parse_url('ssh://10.0.0.1') == ('ssh', ['10.0.0.1'], 22, '/')
+    assert urlindex.parse_url('') is None and urlindex.parse_url('http://') is None
+    assert urlindex.parse_url('$') is None
+
+def test_match():
+    db = kpdb.Database(testkdb, passphrase='test')
+    db.import_entries(dict(path='Web', title=title, username='me', url=url)
+                      for title, url in [('parent', 'example.com'),
+                                         ('www', 'https://www.example.com'),
+                                         ('admin', 'https://www.example.com:8443/admin'),
+                                         ('plain', 'http://www.example.com/'),
+                                         ('other', 'https://www.example.org')])
+    titles = lambda url, limit=None: [e.title for e in db.match_url(url, limit)]
+    assert titles('https://www.example.com/index') == ['www', 'admin', 'plain', 'parent']
+    assert titles('https://www.example.com:8443/admin/users') == ['admin', 'www', 'plain', 'parent']
+    assert titles('shop.example.com') == ['parent']
+    assert titles('https://www.example.com', 1) == ['www']
+    assert titles('example.net') == []
+    assert titles('https://mail.example.com/', 3) == ['My Email Account', 'My Email Account', 'parent']
+
+    # edits and removals are followed
+    parent = db.resolve('Web/parent')[0]
+    parent.url = 'https://example.org'
+    assert titles('https://www.example.org') == ['other', 'parent']
+    assert titles('shop.example.com') == []
+    db.remove_entry(db.resolve('Web/other')[0])
+    assert titles('https://www.example.org') == ['parent']
+    db.remove_group(db.resolve('Web')[0])
+    assert db.url_index().root.children.keys() == ['com']
+    assert db.url_index().root.children['com'].children['example'].children.keys() == ['mail']
+
+if '__main__' == __name__:
+    test_parse()
+    test_match()